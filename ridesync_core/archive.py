@@ -0,0 +1,35 @@
+"""Hot/cold split for ``active_requests``.
+
+Completed and cancelled requests are moved, a batch at a time, into
+``archived_requests`` (bucketed by ``day``) so the polling queries only ever
+walk pending and accepted work. Reporting code that needs every request can
+read the ``all_requests`` view, which unions both tables. The expiry worker
+(``ridesync_core.expiry``) runs a sweep every ``ARCHIVE_INTERVAL`` seconds.
+"""
+import time
+
+from . import db
+
+BATCH_SIZE = 500
+ARCHIVE_INTERVAL = 60  # seconds between sweeps
+
+
+def archive_terminal_requests(batch_size=BATCH_SIZE, db_name=None):
+    """Move one batch of terminal requests to cold storage; returns how many moved."""
+    now = time.time()
+    with db.transaction(db_name) as s:
+        ids = [(row['id'],) for row in s.fetchall('terminal_request_ids', (batch_size,))]
+        s.executemany('archive_request', [(now, req_id) for (req_id,) in ids])
+        s.executemany('delete_request', ids)
+    return len(ids)
+
+
+def archive_all(batch_size=BATCH_SIZE, db_name=None):
+    """Drain every terminal request, one short transaction per batch."""
+    total = 0
+    while True:
+        moved = archive_terminal_requests(batch_size, db_name)
+        total += moved
+        if moved < batch_size:
+            return total
+
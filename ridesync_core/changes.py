@@ -0,0 +1,66 @@
+"""Per-channel change counters for change-driven refresh.
+
+Every mutation in ``RequestManager`` bumps a counter for each channel the
+affected row belongs to: its vehicle type, its passenger, its driver and, for
+shared rides, ``SHARED_CHANNEL``. A polling session remembers the counters for
+the channels it displays and only re-reads once one of them moves, instead of
+re-running every query once a second whether or not anything happened. It
+checks them ``MIN_POLL_INTERVAL`` after a change and backs off to
+``MAX_POLL_INTERVAL`` while nothing moves (``next_interval``), so an idle
+session costs a lookup every 12 s rather than every second; the first
+change it sees drops it straight back to 1 s.
+
+Counters are bumped in the same transaction as the mutation, so with
+several shards (``ridesync_core.shards``) each shard keeps its own; a
+channel's version is the sum across shards, which still only ever grows.
+"""
+from . import db, shards
+
+MIN_POLL_INTERVAL = 1.0    # seconds between checks right after a change (one fragment tick)
+MAX_POLL_INTERVAL = 12.0   # ceiling while idle (1, 2, 4, 8, 12 s), under Ridesync's 15 s idle refresh
+BACKOFF = 2.0
+SHARED_CHANNEL = 'rides:shared'
+
+
+def vehicle_channel(vehicle):
+    return f'vehicle:{vehicle}'
+
+
+def passenger_channel(passenger):
+    return f'passenger:{passenger}'
+
+
+def driver_channel(driver):
+    return f'driver:{driver}'
+
+
+def channels_for(row):
+    """Channels a request row is visible on."""
+    channels = [vehicle_channel(row['vehicle']), passenger_channel(row['passenger'])]
+    if row['driver']:
+        channels.append(driver_channel(row['driver']))
+    if row['ride_type'] == 'Shared':
+        channels.append(SHARED_CHANNEL)
+    return channels
+
+
+def bump(session, channels):
+    """Advance the counters for ``channels`` inside the caller's transaction."""
+    for channel in set(channels):
+        session.execute('bump_change', (channel,))
+
+
+def versions(channels, db_name=None):
+    """Current counter for each channel, as a tuple in the order given."""
+    totals = [0] * len(channels)
+    for shard in shards.layout(db_name).names:
+        with db.session(shard) as s:
+            for i, channel in enumerate(channels):
+                row = s.fetchone('change_version', (channel,))
+                totals[i] += row[0] if row else 0
+    return tuple(totals)
+
+
+def next_interval(interval, changed):
+    """Seconds until the next counter check: ``MIN_POLL_INTERVAL`` after a change, else backed off by ``BACKOFF``."""
+    return MIN_POLL_INTERVAL if changed else min(interval * BACKOFF, MAX_POLL_INTERVAL)
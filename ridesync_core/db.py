@@ -0,0 +1,201 @@
+"""Process-wide pooled SQLite access.
+
+Every Streamlit session runs in its own thread and reruns the script about
+once a second, so opening a fresh ``sqlite3.connect`` per query is both slow
+and a source of "database is locked" errors. This module keeps a small pool
+of long-lived connections per database file, all opened in WAL mode so
+readers never block the writer, and runs writes in ``BEGIN IMMEDIATE``
+transactions so lock contention is resolved by ``busy_timeout`` instead of
+failing halfway through. How often a transaction had to wait for the write
+lock (and for how long) is counted in ``lock_stats()``. With
+``RIDESYNC_METRICS=1`` every named statement is also timed (see
+``ridesync_core.metrics``).
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from . import metrics
+from .queries import SQL
+
+DB_NAME = os.environ.get('RIDESYNC_DB', 'ridesync.db')
+
+BUSY_TIMEOUT_MS = 5000
+
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),   # safe with WAL, avoids an fsync per commit
+    ('busy_timeout', BUSY_TIMEOUT_MS),
+    ('cache_size', -16000),      # ~16 MB page cache per connection
+    ('mmap_size', 268435456),    # 256 MB memory-mapped reads
+    ('temp_store', 'MEMORY'),
+)
+
+STATEMENT_CACHE_SIZE = 256
+MAX_IDLE_CONNECTIONS = 8
+LOCK_WAIT_S = 0.001   # a BEGIN IMMEDIATE slower than this waited for another writer
+
+
+class Session:
+    """A checked-out connection that runs statements from ``SQL`` by name."""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, name, params=()):
+        if metrics.ENABLED:
+            with metrics.timer('ridesync_query_seconds', query=name):
+                return self.conn.execute(SQL[name], params)
+        return self.conn.execute(SQL[name], params)
+
+    def executemany(self, name, seq_of_params):
+        if metrics.ENABLED:
+            with metrics.timer('ridesync_query_seconds', query=name):
+                return self.conn.executemany(SQL[name], seq_of_params)
+        return self.conn.executemany(SQL[name], seq_of_params)
+
+    # Timed including the fetch, which is where SQLite does most of a SELECT's work
+    def fetchone(self, name, params=()):
+        if metrics.ENABLED:
+            with metrics.timer('ridesync_query_seconds', query=name):
+                return self.conn.execute(SQL[name], params).fetchone()
+        return self.conn.execute(SQL[name], params).fetchone()
+
+    def fetchall(self, name, params=()):
+        if metrics.ENABLED:
+            with metrics.timer('ridesync_query_seconds', query=name):
+                return self.conn.execute(SQL[name], params).fetchall()
+        return self.conn.execute(SQL[name], params).fetchall()
+
+
+class ConnectionPool:
+    """Hands out tuned connections to one database file and takes them back."""
+    def __init__(self, db_name, max_idle=MAX_IDLE_CONNECTIONS):
+        self.db_name = db_name
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None,            # we issue BEGIN/COMMIT ourselves
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma, value in PRAGMAS:
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name=None):
+    db_name = db_name or DB_NAME
+    pool = _pools.get(db_name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(db_name, ConnectionPool(db_name))
+    return pool
+
+
+@contextmanager
+def connection(db_name=None):
+    """Borrow a raw pooled connection (e.g. for ``pandas.read_sql_query``)."""
+    pool = get_pool(db_name)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+@contextmanager
+def session(db_name=None):
+    """Borrow a pooled connection for reads outside an explicit transaction."""
+    with connection(db_name) as conn:
+        yield Session(conn)
+
+
+_lock_waits = {'waits': 0, 'wait_seconds': 0.0, 'timeouts': 0}
+_lock_waits_lock = threading.Lock()
+
+
+def _count_wait(seconds, timed_out=False):
+    metrics.observe('ridesync_lock_wait_seconds', seconds)
+    with _lock_waits_lock:
+        _lock_waits['waits'] += 1
+        _lock_waits['wait_seconds'] += seconds
+        _lock_waits['timeouts'] += timed_out
+
+
+def lock_stats(reset=False):
+    """Write-lock waits in this process so far: ``{'waits', 'wait_seconds', 'timeouts'}``."""
+    with _lock_waits_lock:
+        stats = dict(_lock_waits)
+        if reset:
+            _lock_waits.update(waits=0, wait_seconds=0.0, timeouts=0)
+    return stats
+
+
+@contextmanager
+def transaction(db_name=None):
+    """Run the block in a ``BEGIN IMMEDIATE`` transaction; commit or roll back."""
+    with connection(db_name) as conn:
+        start = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e):
+                _count_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        waited = time.perf_counter() - start
+        if waited > LOCK_WAIT_S:
+            _count_wait(waited)
+        try:
+            yield Session(conn)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def fetchone(name, params=(), db_name=None):
+    with session(db_name) as s:
+        return s.fetchone(name, params)
+
+
+def fetchall(name, params=(), db_name=None):
+    with session(db_name) as s:
+        return s.fetchall(name, params)
+
+
+def execute(name, params=(), db_name=None):
+    """Run a single write statement in its own transaction and return its cursor."""
+    with transaction(db_name) as s:
+        return s.execute(name, params)
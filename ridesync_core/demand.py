@@ -0,0 +1,130 @@
+"""Rolling demand/supply counters per pickup zone and vehicle type.
+
+Booking, accepting, cancelling and expiring a request each append a row to
+``request_events`` (see ``ridesync_core.feed``). ``DemandStats`` tails that
+log in every shard -- an indexed range read of only the rows it has not
+seen -- and adds each event to a ring buffer of per-minute buckets for its
+``(pickup, vehicle)``. Reading a window total touches ``WINDOW_MINUTES`` buckets no
+matter how many requests there were, and since the buckets are keyed by the
+event's own timestamp every process arrives at the same numbers.
+
+``surge()`` turns the window's demand against what drivers actually took
+into a fare multiplier for ``fares.quote``/``calculate_price``. It is off
+unless ``RIDESYNC_SURGE=1``.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from . import db, shards
+
+WINDOW_MINUTES = 15
+KINDS = ('created', 'accepted', 'cancelled', 'expired')
+SURGE_ENABLED = os.environ.get('RIDESYNC_SURGE', '0') == '1'
+SURGE_MIN_DEMAND = 3       # requests in the window before surge can kick in
+SURGE_SLOPE = 0.25         # multiplier gained per unit of unmet demand ratio
+SURGE_STEP = 0.1           # multipliers are rounded to this step
+MAX_SURGE = 2.0
+
+
+class RingCounter:
+    """Per-minute counts of each event kind over the last ``window`` minutes."""
+    def __init__(self, window=WINDOW_MINUTES):
+        self.window = window
+        self.minutes = np.full(window, -1, dtype=np.int64)
+        self.counts = np.zeros((window, len(KINDS)), dtype=np.int64)
+        self.pending = 0
+
+    def add(self, minute, kind):
+        slot = minute % self.window
+        if self.minutes[slot] != minute:
+            if self.minutes[slot] > minute:
+                return          # older than anything the window still holds
+            self.minutes[slot] = minute
+            self.counts[slot] = 0
+        self.counts[slot, KINDS.index(kind)] += 1
+
+    def totals(self, minute):
+        """``{kind: count}`` over the window ending at ``minute``."""
+        live = self.minutes > minute - self.window
+        return dict(zip(KINDS, self.counts[live].sum(axis=0).tolist()))
+
+
+class DemandStats:
+    """Windowed event counts for every ``(pickup, vehicle)`` seen, fed from the request event log."""
+    def __init__(self, db_name=None, window=WINDOW_MINUTES):
+        self.db_name = db_name
+        self.window = window
+        self.counters = defaultdict(lambda: RingCounter(self.window))
+        self.seq = {}            # shard -> last seq folded in
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Fold in every event logged since the last call; returns how many."""
+        with self._lock:
+            folded = 0
+            for shard in shards.layout(self.db_name).names:
+                if shard not in self.seq:
+                    rows = db.fetchall('request_events_from', (time.time() - self.window * 60,), shard)
+                    seq = 0
+                else:
+                    seq = self.seq[shard]
+                    rows = db.fetchall('request_events_after', (seq,), shard)
+                for row in rows:
+                    counter = self.counters[(row['pickup'], row['vehicle'])]
+                    counter.add(int(row['at'] // 60), row['kind'])
+                    counter.pending = max(counter.pending + (1 if row['kind'] == 'created' else -1), 0)
+                    seq = max(seq, row['seq'])
+                self.seq[shard] = seq
+                folded += len(rows)
+            return folded
+
+    def snapshot(self, pickup, vehicle, now=None):
+        """Window totals per event kind plus the requests still pending, for one zone and vehicle."""
+        minute = int((now or time.time()) // 60)
+        with self._lock:
+            counter = self.counters.get((pickup, vehicle))
+            if counter is None:
+                return dict.fromkeys(KINDS, 0) | {'pending': 0}
+            return counter.totals(minute) | {'pending': counter.pending}
+
+    def zones(self, now=None):
+        """``{(pickup, vehicle): snapshot}`` for every zone with activity."""
+        with self._lock:
+            keys = list(self.counters)
+        return {key: self.snapshot(*key, now=now) for key in keys}
+
+    def surge(self, pickup, vehicle, now=None):
+        """Fare multiplier for a new request at ``pickup``: 1.0 unless demand outruns accepted rides."""
+        stats = self.snapshot(pickup, vehicle, now)
+        if stats['created'] < SURGE_MIN_DEMAND:
+            return 1.0
+        unmet = (stats['created'] + 1) / (stats['accepted'] + 1) - 1
+        multiplier = min(1.0 + SURGE_SLOPE * max(unmet, 0.0), MAX_SURGE)
+        return round(round(multiplier / SURGE_STEP) * SURGE_STEP, 2)
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_stats(db_name=None):
+    """The process-wide, up-to-date demand counters for a database."""
+    key = db_name or db.DB_NAME
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = _stats[key] = DemandStats(db_name)
+    stats.refresh()
+    return stats
+
+
+def surge(pickup, vehicles, db_name=None):
+    """Surge multipliers for ``vehicles`` at ``pickup`` (all 1.0 when surge pricing is off)."""
+    if not SURGE_ENABLED:
+        return [1.0] * len(vehicles)
+    stats = get_stats(db_name)
+    return [stats.surge(pickup, v) for v in vehicles]
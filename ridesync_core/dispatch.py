@@ -0,0 +1,188 @@
+"""Central batched dispatch of pending requests to idle drivers.
+
+Instead of every online driver polling the full pending list and racing to
+click Accept, drivers announce themselves (vehicle and position) in
+``driver_presence`` and one dispatcher per process runs a tick every
+``DISPATCH_INTERVAL`` seconds:
+
+1. read the pending requests nobody holds an offer for, and the idle drivers;
+2. per vehicle type, build a pickup-distance cost matrix and solve the
+   assignment for the whole batch at once (``assign``, Hungarian method);
+3. write one offer per assigned pair and bump the driver's channel.
+
+A driver's dashboard then only reads its own offers. Offers lapse after
+``OFFER_TTL``; a declined or lapsed pair is never offered again, and
+accepting still goes through the compare-and-set ``accept_request``.
+Database reads grow with ticks, not with drivers times seconds. With
+request shards (``ridesync_core.shards``) one dispatcher covers them all:
+requests, busy drivers and earlier offers are gathered from every shard and
+each offer is written to its request's shard. A tick that fails is logged
+and the next one simply runs on schedule.
+
+Run it inside the Streamlit process (``start()``) or on its own::
+
+    python -m ridesync_core.dispatch [db]
+"""
+import json
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from . import changes, db, metrics, shards, spatial
+
+DISPATCH_INTERVAL = 2.0   # seconds between dispatch ticks
+OFFER_TTL = 30            # seconds a driver has to answer an offer
+PRESENCE_TTL = 60         # drivers not seen for this long count as offline
+MAX_PICKUP_KM = 15.0      # never offer a pickup further away than this
+
+log = logging.getLogger(__name__)
+
+
+def assign(cost):
+    """Minimum-cost assignment of rows to columns; returns ``[(row, col), ...]``.
+
+    Hungarian method with potentials (O(n^2 m)) on a rectangular matrix; every
+    row of the shorter side gets a column. Pairs with infinite cost are never
+    returned.
+    """
+    original = np.asarray(cost, dtype=np.float64)
+    transposed = original.shape[0] > original.shape[1]
+    cost = original.T if transposed else original
+    n, m = cost.shape
+    if n == 0:
+        return []
+    finite = cost[np.isfinite(cost)]
+    big = (finite.max() + 1) * (n + 1) if finite.size else 1.0
+    a = np.where(np.isfinite(cost), cost, big)
+
+    u, v = np.zeros(n + 1), np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=np.int64)   # match[j] = 1-based row on column j
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while match[j0] != 0:
+            used[j0] = True
+            i0 = match[j0]
+            free = ~used[1:]
+            delta = a[i0 - 1] - u[i0] - v[1:]
+            better = free & (delta < minv[1:])
+            minv[1:][better] = delta[better]
+            way[1:][better] = j0
+            j1 = 1 + int(np.argmin(np.where(free, minv[1:], np.inf)))
+            step = minv[j1]
+            u[match[used]] += step
+            v[used] -= step
+            minv[1:][free] -= step
+            j0 = j1
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+
+    pairs = [(int(match[j]) - 1, j - 1) for j in range(1, m + 1) if match[j]]
+    if transposed:
+        pairs = [(col, row) for row, col in pairs]
+    return sorted((r, c) for r, c in pairs if np.isfinite(original[r, c]))
+
+
+class Dispatcher(threading.Thread):
+    """Offers pending requests to idle drivers in batches."""
+    def __init__(self, db_name=None, interval=DISPATCH_INTERVAL, stops=None):
+        super().__init__(name='ridesync-dispatch', daemon=True)
+        self.db_name = db_name
+        self.interval = interval
+        self.stops = stops or spatial.load_catalogue()
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _pickup(self, row):
+        if row['pickup_lat'] is not None:
+            return row['pickup_lat'], row['pickup_lon']
+        return self.stops.stops.get(row['pickup'])
+
+    def tick(self, now=None):
+        """Run one dispatch round; returns the ``(request_id, driver)`` offers written."""
+        now = now or time.time()
+        layout = shards.layout(self.db_name)
+        requests = layout.gather('dispatch_requests', (now, now))
+        if not requests:
+            return []
+        drivers = db.fetchall('online_drivers', (now - PRESENCE_TTL,), self.db_name)
+        names = json.dumps([d['driver'] for d in drivers])
+        busy = {r['driver'] for r in layout.gather('busy_drivers', (names, names, now))} if drivers else set()
+        drivers = [d for d in drivers if d['driver'] not in busy]
+        if not drivers:
+            return []
+        tried = {(r['request_id'], r['driver'])
+                 for r in layout.gather('stale_offers', (json.dumps([r['id'] for r in requests]), now))}
+
+        by_vehicle = defaultdict(lambda: ([], []))
+        for r in requests:
+            point = self._pickup(r)
+            if point is not None:
+                by_vehicle[r['vehicle']][0].append((r['id'], point))
+        for d in drivers:
+            if d['lat'] is not None:
+                by_vehicle[d['vehicle']][1].append((d['driver'], (d['lat'], d['lon'])))
+
+        offers = []
+        for reqs, drvs in by_vehicle.values():
+            if not reqs or not drvs:
+                continue
+            cost = np.array([[spatial.haversine_km(point, at) for _, at in drvs] for _, point in reqs])
+            cost[cost > MAX_PICKUP_KM] = np.inf
+            for i, (req_id, _) in enumerate(reqs):
+                for j, (driver, _) in enumerate(drvs):
+                    if (req_id, driver) in tried:
+                        cost[i, j] = np.inf
+            offers += [(reqs[i][0], drvs[j][0]) for i, j in assign(cost)]
+        if not offers:
+            return []
+
+        by_shard = defaultdict(list)
+        for req_id, driver in offers:
+            by_shard[layout.of_id(req_id)].append((req_id, driver))
+        for shard, batch in by_shard.items():
+            with db.transaction(shard) as s:
+                for req_id, driver in batch:
+                    s.execute('put_offer', (req_id, driver, now + OFFER_TTL))
+                changes.bump(s, [changes.driver_channel(driver) for _, driver in batch])
+        return offers
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                with metrics.timer('ridesync_worker_seconds', task='dispatch'):
+                    self.tick()
+            except Exception:
+                # A locked database or a bad row must not end dispatch for the life of the process
+                log.exception("dispatch tick failed")
+                metrics.count('ridesync_worker_errors_total', task='dispatch')
+
+
+_dispatchers = {}
+_lock = threading.Lock()
+
+
+def start(db_name=None):
+    """Start (once per process and database) and return the dispatcher."""
+    key = db_name or db.DB_NAME
+    with _lock:
+        dispatcher = _dispatchers.get(key)
+        if dispatcher is None or not dispatcher.is_alive():
+            dispatcher = _dispatchers[key] = Dispatcher(db_name)
+            dispatcher.start()
+    return dispatcher
+
+
+if __name__ == '__main__':
+    Dispatcher(sys.argv[1] if len(sys.argv) > 1 else None).run()
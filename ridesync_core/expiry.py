@@ -0,0 +1,163 @@
+"""Background expiry of pending requests.
+
+Instead of sweeping ``active_requests`` on every page load, one worker
+thread per process keeps a min-heap of ``(expiry_time, id)`` for pending
+requests and only touches the database when the earliest one comes due.
+Requests booked in this process are pushed onto the heap straight away via
+``notify``; requests booked by other processes are picked up by a periodic
+resync from the (covering) pending-expiry index. With request shards
+(``ridesync_core.shards``) the one worker covers every shard; request ids
+say which shard to expire them in.
+
+The same worker also drives the periodic archive sweep, prunes the
+request event log and, with offline retention, trims ride history. A round
+that fails (a database still locked after ``busy_timeout``, say) is logged,
+and the next one retries ``ERROR_BACKOFF`` seconds later from a fresh resync;
+the worker itself never dies. It can run inside the Streamlit process (``start()``)
+or on its own::
+
+    python -m ridesync_core.expiry [db]
+"""
+import heapq
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from . import archive, changes, db, feed, history, metrics, shards
+
+RESYNC_INTERVAL = 30  # seconds between reloads of pending deadlines from the DB
+ERROR_BACKOFF = 1     # seconds before retrying after a failed round
+
+log = logging.getLogger(__name__)
+
+
+class ExpiryScheduler(threading.Thread):
+    """Expires pending requests exactly when their ``expiry_time`` passes."""
+    def __init__(self, db_name=None, resync_interval=RESYNC_INTERVAL):
+        super().__init__(name='ridesync-expiry', daemon=True)
+        self.db_name = db_name
+        self.shards = shards.layout(db_name)
+        self.resync_interval = resync_interval
+        self._heap = []
+        self._cond = threading.Condition()
+        self._stopped = False
+
+    def schedule(self, req_id, expiry_time):
+        with self._cond:
+            heapq.heappush(self._heap, (expiry_time, req_id))
+            if self._heap[0][1] == req_id:
+                self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def resync(self):
+        """Add every pending request in the database to the heap.
+
+        Merged rather than replaced: a request notified just before the
+        resync may not be visible yet (the in-memory backend writes behind).
+        Entries for requests that have since left pending expire as no-ops.
+        """
+        rows = self.shards.gather('pending_expiries')
+        with self._cond:
+            self._heap = list({*self._heap, *((row['expiry_time'], row['id']) for row in rows)})
+            heapq.heapify(self._heap)
+
+    def expire_due(self, now=None):
+        """Cancel every scheduled request whose deadline has passed; returns how many."""
+        now = now or time.time()
+        with self._cond:
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[1])
+        by_shard = defaultdict(list)
+        for req_id in due:
+            by_shard[self.shards.of_id(req_id)].append(req_id)
+        expired = 0
+        for shard, req_ids in by_shard.items():
+            with db.transaction(shard) as s:
+                for req_id in req_ids:
+                    # Conditional: a request accepted or cancelled meanwhile is left alone
+                    if s.execute('expire_request', (req_id, now)).rowcount:
+                        s.execute('mark_expired', (req_id,))
+                        expired += 1
+                        changes.bump(s, changes.channels_for(s.fetchone('request_channels', (req_id,))))
+        return expired
+
+    def cancel_duplicates(self):
+        """Cancel legacy duplicate pending rows, from before insert-time duplicate suppression."""
+        for shard in self.shards.names:
+            with db.transaction(shard) as s:
+                touched = s.fetchall('duplicate_requests')
+                s.execute('cancel_duplicate_requests')
+                changes.bump(s, [ch for row in touched for ch in changes.channels_for(row)])
+
+    def run(self):
+        cleaned = False
+        next_resync = 0
+        next_archive = 0
+        while True:
+            now = time.time()
+            retry_at = 0
+            try:
+                if not cleaned:
+                    self.cancel_duplicates()
+                    cleaned = True
+                if now >= next_resync:
+                    self.resync()
+                    next_resync = now + self.resync_interval
+                if now >= next_archive:
+                    with metrics.timer('ridesync_worker_seconds', task='archive'):
+                        for shard in self.shards.names:
+                            archive.archive_all(db_name=shard)
+                            feed.prune_events(db_name=shard)
+                        if history.RETENTION == 'offline':
+                            history.compact(db_name=self.db_name)
+                    next_archive = now + archive.ARCHIVE_INTERVAL
+                with metrics.timer('ridesync_worker_seconds', task='expire'):
+                    self.expire_due(now)
+            except Exception:
+                # expire_due may have popped deadlines it never applied: resync before retrying
+                log.exception("expiry round failed; retrying in %ss", ERROR_BACKOFF)
+                metrics.count('ridesync_worker_errors_total', task='expiry')
+                retry_at = next_resync = time.time() + ERROR_BACKOFF
+            with self._cond:
+                if self._stopped:
+                    return
+                wake_at = min(next_resync, next_archive)
+                if self._heap:
+                    wake_at = min(wake_at, self._heap[0][0])
+                self._cond.wait(max(max(wake_at, retry_at) - time.time(), 0))
+                if self._stopped:
+                    return
+
+
+_schedulers = {}
+_lock = threading.Lock()
+
+
+def start(db_name=None):
+    """Start (once per process and database) and return the expiry worker."""
+    key = db_name or db.DB_NAME
+    with _lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None or not scheduler.is_alive():
+            scheduler = _schedulers[key] = ExpiryScheduler(db_name)
+            scheduler.start()
+    return scheduler
+
+
+def notify(req_id, expiry_time, db_name=None):
+    """Tell this process's worker (if any) about a newly booked request."""
+    scheduler = _schedulers.get(db_name or db.DB_NAME)
+    if scheduler is not None:
+        scheduler.schedule(req_id, expiry_time)
+
+
+if __name__ == '__main__':
+    worker = ExpiryScheduler(sys.argv[1] if len(sys.argv) > 1 else None)
+    worker.run()
@@ -0,0 +1,129 @@
+"""Streaming ride-history export to CSV or Parquet.
+
+Rides are read from SQLite a chunk at a time with keyset pagination and
+turned into the same columns the history table shows
+(``RideHistoryManager.to_display``). Writers consume those chunks one by
+one, so memory stays bounded by ``CHUNK_ROWS`` however long the history
+is; ``to_file`` spools the result to disk past ``SPOOL_BYTES``. The
+Streamlit download buttons pass a callable, so nothing is built until the
+user actually clicks; it returns the finished file as bytes, the only kind
+of data (besides text and a few io types) Streamlit serves.
+
+Parquet needs ``pyarrow``; it is imported only when a Parquet export runs,
+and pandas only when an export does.
+
+Bulk export of every user's rides over a date range (local dates, end
+exclusive)::
+
+    python -m ridesync_core.export OUT.csv|OUT.parquet [--from 2025-12-01] [--to 2026-01-01] [--user NAME] [--db PATH]
+"""
+import importlib.util
+import sys
+import tempfile
+from datetime import datetime
+
+from . import db, metrics
+from .history import RideHistoryManager
+
+CHUNK_ROWS = 5000
+SPOOL_BYTES = 8 * 1024 * 1024     # exports larger than this spill to a temp file
+MIME_TYPES = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+
+def parquet_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def iter_user_rides(username, chunk_rows=CHUNK_ROWS, db_name=None):
+    """History frames for one user, newest first, ``chunk_rows`` rides at a time."""
+    manager = RideHistoryManager(db_name)
+    cursor = None
+    while True:
+        df, cursor = manager.get_history_page(username, cursor, chunk_rows)
+        if not df.empty:
+            yield df
+        if cursor is None:
+            return
+
+
+def iter_all_rides(start=None, end=None, chunk_rows=CHUNK_ROWS, db_name=None):
+    """History frames (with a leading ``Username`` column) for every ride with ``start <= timestamp < end``, oldest first."""
+    import pandas as pd
+    timestamp, ride_id = (start if start is not None else float('-inf')), 0
+    end = end if end is not None else float('inf')
+    while True:
+        with db.connection(db_name) as conn, metrics.timer('ridesync_query_seconds', query='rides_between_page'):
+            rides = pd.read_sql_query(db.SQL['rides_between_page'], conn, params=(timestamp, ride_id, end, chunk_rows))
+        if rides.empty:
+            return
+        df = RideHistoryManager.to_display(rides)
+        df.insert(0, 'Username', rides['username'].to_numpy())
+        yield df
+        if len(rides) < chunk_rows:
+            return
+        timestamp, ride_id = float(rides['timestamp'].iloc[-1]), int(rides['id'].iloc[-1])
+
+
+def write_csv(frames, out):
+    """Write frames to a binary file object as one CSV; returns the number of rows."""
+    rows = 0
+    for df in frames:
+        out.write(df.to_csv(index=False, header=rows == 0).encode('utf-8'))
+        rows += len(df)
+    return rows
+
+
+def write_parquet(frames, out):
+    """Write frames to a binary file object as one Parquet file, a row group per chunk; returns the number of rows."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer, rows = None, 0
+    try:
+        for df in frames:
+            table = pa.Table.from_pandas(df, schema=writer.schema if writer else None, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(out, table.schema)
+            writer.write_table(table)
+            rows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+WRITERS = {'csv': write_csv, 'parquet': write_parquet}
+
+
+def to_file(frames, fmt='csv'):
+    """Stream frames into a rewound (spooled) temp file, ready to hand to a download."""
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    WRITERS[fmt](frames, out)
+    out.seek(0)
+    return out
+
+
+def user_export(username, fmt='csv', db_name=None):
+    """Zero-argument callable for ``st.download_button(data=...)``: builds the file only when clicked, as bytes."""
+    def build():
+        with to_file(iter_user_rides(username, db_name=db_name), fmt) as out:
+            return out.read()
+    return build
+
+
+def _local_date(text):
+    """Local midnight of a ``YYYY-MM-DD`` date, with that date's own UTC offset (as in ``user_monthly``)."""
+    return datetime.strptime(text, '%Y-%m-%d').timestamp()
+
+
+if __name__ == '__main__':
+    path, opts = sys.argv[1], dict(zip(sys.argv[2::2], sys.argv[3::2]))
+    fmt = 'parquet' if path.endswith('.parquet') else 'csv'
+    db_name = opts.get('--db')
+    if '--user' in opts:
+        frames = iter_user_rides(opts['--user'], db_name=db_name)
+    else:
+        frames = iter_all_rides(_local_date(opts['--from']) if '--from' in opts else None,
+                                _local_date(opts['--to']) if '--to' in opts else None, db_name=db_name)
+    with open(path, 'wb') as f:
+        rows = WRITERS[fmt](frames, f)
+    print(f"{rows} rides -> {path}")
@@ -0,0 +1,150 @@
+"""Fare quotes: the scalar reference formula plus vectorized bulk quoting.
+
+``calculate_price`` is the tariff as it has always been applied: a fixed
+charge plus a per-km rate, cars never cheaper than an auto plus
+``CAR_MARGIN_OVER_AUTO``, times an optional surge multiplier (see
+``ridesync_core.demand``), shared rides at ``SHARED_FACTOR``, rounded half to
+even. ``quote`` applies exactly the same arithmetic, in the same order, to
+whole arrays of distances and returns an integer fare matrix indexed
+``[..., vehicle, sharing]``, so its results are identical to the scalar
+function (``tests/test_fares.py`` checks this).
+
+A ``FareTable`` holds the fares for every pair of stops. It is built in the
+background once the routes are known (``precompute_async``) and cached per
+stop list and tariff; changing ``TARIFFS`` changes ``tariff_key()`` and so
+makes the next lookup build a fresh table. Lookups only answer for the exact
+distance the table was built with, so a quote never disagrees with the route
+the passenger is shown.
+"""
+import json
+import threading
+
+import numpy as np
+
+from . import metrics
+
+TARIFFS = {'bike': {'fixed': 15, 'rate': 8}, 'auto': {'fixed': 25, 'rate': 12}, 'car': {'fixed': 45, 'rate': 18}}
+CAR_MARGIN_OVER_AUTO = 15
+SHARED_FACTOR = 0.8
+VEHICLES = ('bike', 'auto', 'car')
+SHARING = (False, True)
+MAX_TABLE_STOPS = 40       # n*n pairs; larger catalogues are quoted per route
+
+
+def tariff_key(tariffs=None):
+    return json.dumps(tariffs or TARIFFS, sort_keys=True)
+
+
+def calculate_price(distance, vehicle_type, sharing, tariffs=None, surge=1.0):
+    params = tariffs or TARIFFS
+    p = params[vehicle_type]
+    raw_price = p['fixed'] + (distance * p['rate'])
+    if vehicle_type == 'car':
+        auto_price = params['auto']['fixed'] + (distance * params['auto']['rate'])
+        if raw_price < (auto_price + CAR_MARGIN_OVER_AUTO): raw_price = auto_price + CAR_MARGIN_OVER_AUTO
+    raw_price = raw_price * surge
+    return round(raw_price * SHARED_FACTOR if sharing else raw_price)
+
+
+def quote(distances, vehicles=VEHICLES, sharing=SHARING, tariffs=None, surge=1.0):
+    """Fares for every distance x vehicle x sharing flag, as ``int64[..., len(vehicles), len(sharing)]``.
+
+    ``surge`` is a scalar or one multiplier per vehicle.
+    """
+    params = tariffs or TARIFFS
+    d = np.asarray(distances, dtype=np.float64)[..., None]
+    fixed = np.array([params[v]['fixed'] for v in vehicles], dtype=np.float64)
+    rate = np.array([params[v]['rate'] for v in vehicles], dtype=np.float64)
+    raw = fixed + (d * rate)
+    auto_floor = (params['auto']['fixed'] + (d * params['auto']['rate'])) + CAR_MARGIN_OVER_AUTO
+    is_car = np.array([v == 'car' for v in vehicles])
+    raw = (np.where(is_car & (raw < auto_floor), auto_floor, raw) * np.asarray(surge, dtype=np.float64))[..., None]
+    shared = np.array(sharing, dtype=bool)
+    return np.rint(np.where(shared, raw * SHARED_FACTOR, raw)).astype(np.int64)
+
+
+class FareTable:
+    """Fares for every ordered pair of named stops, from one distance matrix."""
+    def __init__(self, names, distances, tariffs=None):
+        self.names = tuple(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.distances = np.asarray(distances, dtype=np.float64)
+        self.key = tariff_key(tariffs)
+        self.fares = quote(self.distances, tariffs=tariffs)
+
+    @classmethod
+    def build(cls, names, distance_fn, tariffs=None):
+        """Table from ``distance_fn(src, dst)`` over every pair of ``names``."""
+        names = list(names)
+        distances = [[0 if a == b else distance_fn(a, b) for b in names] for a in names]
+        return cls(names, distances, tariffs)
+
+    def lookup(self, src, dst, distance):
+        """``int64[vehicle, sharing]`` fares, or None if the pair or its distance is not in the table."""
+        i, j = self.index.get(src), self.index.get(dst)
+        if i is None or j is None or self.distances[i, j] != distance:
+            return None
+        return self.fares[i, j]
+
+
+_tables = {}
+_builders = {}       # stop names -> distance_fn, to rebuild after a tariff change
+_building = set()
+_lock = threading.Lock()
+
+
+def _table_key(names, tariffs):
+    return tuple(names), tariff_key(tariffs)
+
+
+def precompute_async(names, distance_fn, after=None, tariffs=None):
+    """Build the table for ``names`` in a background thread (after ``after`` finishes, if given)."""
+    names = list(names)
+    key = _table_key(names, tariffs)
+    if len(names) > MAX_TABLE_STOPS:
+        return
+    with _lock:
+        _builders[key[0]] = distance_fn
+        if key in _tables or key in _building:
+            return
+        _building.add(key)
+
+    def build():
+        try:
+            if after is not None:
+                after.join()
+            table = FareTable.build(names, distance_fn, tariffs)
+            with _lock:
+                # Tables for superseded tariffs are never looked up again
+                for old in [k for k in _tables if k[0] == key[0]]:
+                    del _tables[old]
+                _tables[key] = table
+        finally:
+            with _lock:
+                _building.discard(key)
+
+    threading.Thread(target=build, name='ridesync-fares', daemon=True).start()
+
+
+def fares_for(names, src, dst, distance, tariffs=None, surge=1.0):
+    """``int64[vehicle, sharing]`` fares for one route: from the cached table if it has it, else quoted now.
+
+    The table holds base fares; any surge other than 1.0 is quoted directly.
+    """
+    if np.any(np.asarray(surge) != 1.0):
+        return quote(distance, tariffs=tariffs, surge=surge)
+    key = _table_key(names, tariffs)
+    table = _tables.get(key)
+    if table is None and key[0] in _builders:
+        precompute_async(key[0], _builders[key[0]], tariffs=tariffs)
+    fares = table.lookup(src, dst, distance) if table is not None else None
+    metrics.count('ridesync_cache_requests_total', cache='fare_table')
+    if fares is None:
+        metrics.count('ridesync_cache_misses_total', cache='fare_table')
+    return fares if fares is not None else quote(distance, tariffs=tariffs)
+
+
+def price(fares, vehicle, sharing):
+    """Pick one fare out of a ``fares_for``/``quote`` row."""
+    return int(fares[VEHICLES.index(vehicle), SHARING.index(bool(sharing))])
+
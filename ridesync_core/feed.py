@@ -0,0 +1,69 @@
+"""Delta-fed view of the pending requests for one vehicle type.
+
+Triggers on ``active_requests`` append a row to ``request_events`` whenever a
+request is created or leaves pending (accepted, cancelled, expired), each
+with an increasing ``seq`` (one sequence per shard, see
+``ridesync_core.shards``). A ``PendingView`` loads the pending list once and
+from then on only applies the events after the last position it saw, via
+``RequestManager.changes_since``. Requests the driver chose to ignore are
+hidden and forgotten as soon as they reach a terminal state, so the ignore
+set stays as small as the list itself.
+
+Events older than ``EVENT_RETENTION`` are pruned by the expiry worker; a view
+that falls further behind than that simply reloads.
+"""
+import time
+
+from . import db
+
+EVENT_RETENTION = 3600  # seconds of request events kept for catching up
+
+
+class PendingView:
+    """One session's materialized list of pending requests for a vehicle."""
+    def __init__(self, manager, vehicle):
+        self.manager = manager
+        self.vehicle = vehicle
+        self.rows = {}
+        self.ignored = set()
+        self.position = None
+
+    def reload(self):
+        # Take the position first: replaying events we already see is harmless
+        latest = self.manager.event_position()
+        self.rows = {r['id']: r for r in self.manager.get_pending_requests(self.vehicle)}
+        self.ignored &= self.rows.keys()
+        self.position = latest
+
+    def refresh(self):
+        """Bring the view up to date; returns the number of events applied."""
+        if self.position is None:
+            self.reload()
+            return 0
+        delta = self.manager.changes_since(self.position, self.vehicle)
+        if delta is None:
+            self.reload()
+            return 0
+        self.position, events = delta
+        for event in events:
+            req_id = event['request_id']
+            if event['kind'] == 'created' and event['status'] == 'pending':
+                self.rows[req_id] = event
+            else:
+                self.rows.pop(req_id, None)
+                self.ignored.discard(req_id)
+        return len(events)
+
+    def ignore(self, req_id):
+        self.ignored.add(req_id)
+
+    def visible(self, now=None):
+        """Unexpired, unignored requests, oldest first."""
+        now = now or time.time()
+        return [r for req_id, r in sorted(self.rows.items())
+                if req_id not in self.ignored and r['expiry_time'] > now]
+
+
+def prune_events(retention=EVENT_RETENTION, db_name=None):
+    """Drop request events older than ``retention`` seconds; returns how many."""
+    return db.execute('prune_request_events', (time.time() - retention,), db_name).rowcount
@@ -0,0 +1,141 @@
+"""Per-user ride history in the ``rides`` table.
+
+Each user keeps their newest ``HISTORY_LIMIT`` rides (env
+``RIDESYNC_HISTORY_LIMIT``). With ``RIDESYNC_RETENTION=inline`` (the
+default) every insert is followed by a bounded delete that walks the
+``(username, timestamp)`` index past the newest ``HISTORY_LIMIT`` rows and
+drops whatever lies beyond -- normally nothing or one row. With
+``RIDESYNC_RETENTION=offline`` the write path is a plain INSERT and
+``compact()`` trims every user over the limit instead; the expiry worker
+runs it with each archive sweep, or run it on its own::
+
+    python -m ridesync_core.history [db]
+
+pandas is imported by the methods that return frames, on first use, so the
+booking path (``record_ride``, ``get_user_stats``) never loads it.
+
+Times are shown in the zone SQLite's ``'localtime'`` uses (``LOCAL_TZ``), with
+each timestamp's own UTC offset, so a ride's displayed date always falls in
+the month it is summed under in ``user_monthly``, on either side of a DST
+change.
+"""
+import os
+import sys
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from . import db, metrics
+
+HISTORY_LIMIT = int(os.environ.get('RIDESYNC_HISTORY_LIMIT', '20'))
+RETENTION = os.environ.get('RIDESYNC_RETENTION', 'inline')   # 'inline' or 'offline'
+PAGE_SIZE = 50
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+COLUMNS = {'source': 'From', 'destination': 'To', 'vehicle': 'Vehicle',
+           'ride_type': 'Type', 'price': 'Price (₹)', 'status': 'Status'}
+
+
+def local_zone():
+    """The zone SQLite's ``'localtime'`` resolves to: ``$TZ`` if it names one, else ``/etc/localtime``.
+
+    None when neither does (a POSIX rule in ``$TZ``, no tz database);
+    ``to_display`` then converts timestamp by timestamp instead.
+    """
+    name = os.environ.get('TZ', '').lstrip(':')
+    try:
+        if name:
+            return ZoneInfo(name)
+        with open('/etc/localtime', 'rb') as f:
+            return ZoneInfo.from_file(f, key='localtime')
+    except (OSError, ValueError, KeyError):   # ZoneInfoNotFoundError is a KeyError
+        return None
+
+
+LOCAL_TZ = local_zone()   # history is shown in server-local time
+
+
+def record_ride(s, username, ride_data, limit=None):
+    """Insert one history row inside the caller's transaction (and trim, in inline mode)."""
+    timestamp = ride_data.get('timestamp', time.time())
+    ride_type = 'Shared' if ride_data.get('sharing') else 'Solo'
+    s.execute('insert_ride', (username, ride_data.get('from'), ride_data.get('to'), ride_data.get('vehicle'), ride_type, ride_data.get('price'), 'Completed', timestamp))
+    if RETENTION == 'inline':
+        s.execute('trim_rides', (username, limit or HISTORY_LIMIT))
+
+
+def compact(limit=None, db_name=None):
+    """Trim every user's history to ``limit`` rides, one user per transaction; returns rows deleted."""
+    limit = limit or HISTORY_LIMIT
+    deleted = 0
+    for row in db.fetchall('users_over_limit', (limit,), db_name):
+        with db.transaction(db_name) as s:
+            deleted += s.execute('trim_rides', (row['username'], limit)).rowcount
+    return deleted
+
+
+class RideHistoryManager:
+    """Manages ride history using SQLite to support multi-tab."""
+    def __init__(self, db_name=None):
+        self.db_name = db_name
+
+    def add_ride_for_user(self, username, ride_data):
+        with db.transaction(self.db_name) as s:
+            record_ride(s, username, ride_data)
+
+    @staticmethod
+    def to_display(rides):
+        """Raw ``rides`` rows -> the history table's columns, in one vectorized pass."""
+        import pandas as pd
+        if rides.empty: return pd.DataFrame()
+        if LOCAL_TZ is not None:
+            when = pd.to_datetime(rides['timestamp'], unit='s', utc=True).dt.tz_convert(LOCAL_TZ).dt.strftime(TIME_FORMAT)
+        else:
+            when = rides['timestamp'].map(lambda t: datetime.fromtimestamp(t).strftime(TIME_FORMAT))
+        df = rides[list(COLUMNS)].rename(columns=COLUMNS)
+        df.insert(0, 'Date & Time', when)
+        df['Vehicle'] = df['Vehicle'].str.title()
+        return df.reset_index(drop=True)
+
+    def get_user_dataframe(self, username):
+        import pandas as pd
+        with db.connection(self.db_name) as conn, metrics.timer('ridesync_query_seconds', query='user_rides'):
+            df = pd.read_sql_query(db.SQL['user_rides'], conn, params=(username,))
+        return self.to_display(df)
+
+    def get_history_page(self, username, cursor=None, limit=PAGE_SIZE):
+        """One page of history, newest first, and the cursor for the next page (None after the last)."""
+        import pandas as pd
+        timestamp, ride_id = cursor or (float('inf'), 0)
+        with db.connection(self.db_name) as conn, metrics.timer('ridesync_query_seconds', query='user_rides_page'):
+            df = pd.read_sql_query(db.SQL['user_rides_page'], conn, params=(username, timestamp, ride_id, limit))
+        next_cursor = (float(df['timestamp'].iloc[-1]), int(df['id'].iloc[-1])) if len(df) == limit else None
+        return self.to_display(df), next_cursor
+
+    def get_history(self, username, pages=1, limit=PAGE_SIZE):
+        """The newest ``pages`` pages as one frame, and whether there is more."""
+        import pandas as pd
+        frames, cursor = [], None
+        for _ in range(pages):
+            df, cursor = self.get_history_page(username, cursor, limit)
+            frames.append(df)
+            if cursor is None:
+                break
+        frames = [f for f in frames if not f.empty]
+        return (pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()), cursor is not None
+
+    def get_user_stats(self, username):
+        res = db.fetchone('user_stats', (username,), self.db_name)
+        count = res[0] if res else 0
+        total = res[1] if res else 0
+        return {'total_rides': count, 'total_spent': total, 'avg_cost': (total/count if count else 0)}
+
+    def get_monthly_income(self, username):
+        """Ride totals per month, oldest first, labelled like 'Dec 2025'."""
+        import pandas as pd
+        rows = db.fetchall('user_monthly', (username,), self.db_name)
+        labels = [datetime.strptime(r['month'], '%Y-%m').strftime('%b %Y') for r in rows]
+        return pd.Series([r['total_price'] for r in rows], index=pd.Index(labels, name='Month'), name='Price (₹)')
+
+
+if __name__ == '__main__':
+    print(f"{compact(db_name=sys.argv[1] if len(sys.argv) > 1 else None)} rides trimmed")
@@ -0,0 +1,87 @@
+"""Route maps: Douglas–Peucker simplified polylines rendered once to HTML.
+
+OSRM returns the full-resolution geometry, often thousands of points for a
+few kilometres, most of which are closer together than a screen pixel at the
+zoom the map opens at. ``simplify`` drops every point that lies within
+``tolerance`` metres of the line through its neighbours, and
+``route_map_html`` embeds only what is left.
+
+The tolerance is given in screen pixels (env ``RIDESYNC_MAP_TOLERANCE_PX``)
+and converted to metres for the zoom the map is rendered at, so a
+``(pickup, destination, zoom)`` key always yields the same simplified path.
+The rendered page is plain HTML; the app caches it on that key and hands the
+same string to the browser on every rerun, so unrelated widget changes leave
+the map exactly as it was. folium is imported on the first render.
+"""
+import math
+import os
+
+import numpy as np
+
+from . import metrics
+from .spatial import KM_PER_DEG_LAT, KM_PER_DEG_LON
+
+MAP_ZOOM = 13
+MAP_TOLERANCE_PX = float(os.environ.get('RIDESYNC_MAP_TOLERANCE_PX', '1.5'))
+METRES_PER_PIXEL_Z0 = 156543.03    # web-mercator ground resolution at the equator, zoom 0
+
+
+def tolerance_m(lat, zoom=MAP_ZOOM, pixels=None):
+    """Metres covered by ``pixels`` screen pixels at ``lat`` and ``zoom``."""
+    pixels = MAP_TOLERANCE_PX if pixels is None else pixels
+    return pixels * METRES_PER_PIXEL_Z0 * math.cos(math.radians(lat)) / 2 ** zoom
+
+
+def simplify(path, tolerance):
+    """Douglas–Peucker: the points of ``path`` (``[lat, lon]`` pairs) needed to stay within ``tolerance`` metres.
+
+    The endpoints are always kept. Runs on an explicit stack, so long routes
+    cannot hit the recursion limit.
+    """
+    if len(path) < 3 or tolerance <= 0:
+        return [list(p) for p in path]
+    pts = np.asarray(path, dtype=np.float64)
+    # Local equirectangular projection, in metres; plenty for a city-sized route
+    lat0 = math.radians(pts[:, 0].mean())
+    xy = np.column_stack((pts[:, 1] * KM_PER_DEG_LON * 1000 * math.cos(lat0), pts[:, 0] * KM_PER_DEG_LAT * 1000))
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        seg = xy[last] - xy[first]
+        rel = xy[first + 1:last] - xy[first]
+        length = math.hypot(*seg)
+        if length == 0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / length
+        i = int(dist.argmax())
+        if dist[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return pts[keep].tolist()
+
+
+def route_map(src, dst, path_coords, src_name, dst_name, zoom=MAP_ZOOM):
+    """A folium map of the route from ``src`` to ``dst`` (``(lat, lon)``), with the path simplified for ``zoom``."""
+    import folium
+    (src_lat, src_lon), (dst_lat, dst_lon) = src, dst
+    center_lat, center_lon = (src_lat + dst_lat) / 2, (src_lon + dst_lon) / 2
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=zoom)
+    if path_coords:
+        path = simplify(path_coords, tolerance_m(center_lat, zoom))
+        folium.PolyLine(path, color="blue", weight=5, opacity=0.7).add_to(m)
+    folium.Marker([src_lat, src_lon], popup="Pickup", tooltip=src_name, icon=folium.Icon(color="green", icon="play")).add_to(m)
+    folium.Marker([dst_lat, dst_lon], popup="Drop", tooltip=dst_name, icon=folium.Icon(color="red", icon="stop")).add_to(m)
+    return m
+
+
+def route_map_html(src, dst, path_coords, src_name, dst_name, zoom=MAP_ZOOM):
+    """``route_map`` rendered to a standalone HTML page."""
+    with metrics.timer('ridesync_render_seconds', what='route_map'):
+        return route_map(src, dst, path_coords, src_name, dst_name, zoom).get_root().render()
@@ -0,0 +1,98 @@
+"""Vectorized matching of new passengers onto open shared rides.
+
+Open shared rides are held as NumPy columns (coordinates, seats, price) and
+only reloaded when ``changes.SHARED_CHANNEL`` moves. A new passenger is
+scored against every candidate in one pass: the extra distance needed to
+drop them off on the way (cheapest of picking them up and dropping them
+before or after the ride's own drop), how many seats are left and the price.
+Rides that would take too long a detour are discarded and the best ``k``
+are returned.
+"""
+import threading
+
+import numpy as np
+
+from . import changes, db, shards
+from .spatial import EARTH_RADIUS_KM
+
+ROAD_FACTOR = 1.2           # straight line -> rough road distance
+MAX_DETOUR_KM = 2.0         # always acceptable extra distance ...
+MAX_DETOUR_RATIO = 0.5      # ... or this fraction of the passenger's own trip
+PRICE_WEIGHT = 0.02         # km of detour a rupee is worth
+SEAT_WEIGHT = 0.1           # km of detour a spare seat is worth
+TOP_K = 5
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class SharedRideMatcher:
+    """Columnar snapshot of open shared rides for one database."""
+    def __init__(self, db_name=None):
+        self.db_name = db_name
+        self._version = None
+        self._lock = threading.Lock()
+        self._load([])
+
+    def _load(self, rows):
+        rows = [r for r in rows if r['pickup_lat'] is not None and r['dest_lat'] is not None]
+        self.rows = rows
+        col = lambda name, dtype=np.float64: np.array([r[name] for r in rows], dtype=dtype)
+        self.pickup_lat, self.pickup_lon = col('pickup_lat'), col('pickup_lon')
+        self.dest_lat, self.dest_lon = col('dest_lat'), col('dest_lon')
+        self.price = col('price')
+        self.seats_free = col('max_passengers', np.int64) - col('current_passengers', np.int64)
+        self.vehicle = np.array([r['vehicle'] for r in rows], dtype=object)
+        self.ride_km = _haversine_km(self.pickup_lat, self.pickup_lon, self.dest_lat, self.dest_lon)
+
+    def refresh(self):
+        """Reload the columns if any shared ride changed since the last load."""
+        with self._lock:
+            version = changes.versions([changes.SHARED_CHANNEL], self.db_name)
+            if version != self._version:
+                self._load(shards.layout(self.db_name).gather('open_shared_rides'))
+                self._version = version
+
+    def score(self, pickup, destination, vehicle=None):
+        """Detour (km) and score for every loaded ride; ``inf`` where the ride cannot take the passenger."""
+        (plat, plon), (dlat, dlon) = pickup, destination
+        trip_km = _haversine_km(plat, plon, dlat, dlon)
+        to_pickup = _haversine_km(self.pickup_lat, self.pickup_lon, plat, plon)
+        drop_first = trip_km + _haversine_km(dlat, dlon, self.dest_lat, self.dest_lon)
+        drop_last = _haversine_km(plat, plon, self.dest_lat, self.dest_lon) + _haversine_km(self.dest_lat, self.dest_lon, dlat, dlon)
+        detour = (to_pickup + np.minimum(drop_first, drop_last) - self.ride_km) * ROAD_FACTOR
+        ok = (self.seats_free > 0) & (detour <= max(MAX_DETOUR_KM, MAX_DETOUR_RATIO * trip_km * ROAD_FACTOR))
+        if vehicle is not None:
+            ok &= self.vehicle == vehicle
+        score = np.where(ok, detour + PRICE_WEIGHT * self.price - SEAT_WEIGHT * self.seats_free, np.inf)
+        return detour, score
+
+    def top_k(self, pickup, destination, k=TOP_K, vehicle=None):
+        """``[(row, detour_km), ...]`` for the best ``k`` rides, best first."""
+        self.refresh()
+        with self._lock:
+            rows = self.rows
+            if not rows:
+                return []
+            detour, score = self.score(pickup, destination, vehicle)
+        k = min(k, len(rows))
+        best = np.argpartition(score, k - 1)[:k]
+        best = best[np.argsort(score[best], kind='stable')]
+        return [(rows[i], round(float(detour[i]), 2)) for i in best if np.isfinite(score[i])]
+
+
+_matchers = {}
+_matchers_lock = threading.Lock()
+
+
+def get_matcher(db_name=None):
+    """The process-wide matcher for a database."""
+    key = db_name or db.DB_NAME
+    with _matchers_lock:
+        matcher = _matchers.get(key)
+        if matcher is None:
+            matcher = _matchers[key] = SharedRideMatcher(db_name)
+    return matcher
@@ -0,0 +1,393 @@
+"""In-memory live request state with write-behind persistence to SQLite.
+
+``MemoryRequestManager`` has exactly the methods of ``RequestManager`` and is
+picked with ``RIDESYNC_REQUEST_BACKEND=memory`` (see
+``request_manager.open_manager``). Live requests -- pending and accepted --
+are held as rows in dicts indexed by id, passenger, driver and ``(vehicle,
+status)``, and every read of them is answered from those indexes without
+touching disk. Offers, presence and the event feed still live in SQLite,
+where the dispatcher writes them.
+
+Each mutation is decided in memory under one lock, by the same rules the
+compare-and-set statements apply, and appended to a journal. A flusher thread
+writes the journal every ``FLUSH_INTERVAL`` seconds in one transaction using
+the same guarded statements, one savepoint per entry, so the triggers, the
+request event log and the history summaries behave as before; change
+channels are bumped only once the rows are on disk. An entry that loses when
+it reaches the database (an accept racing the expiry worker, a booking made
+by another process) is rolled back and its rows are reloaded: the database
+wins, and the affected channels are bumped so views redraw.
+
+The store is rebuilt from ``active_requests`` when it is created and follows
+changes made outside it by tailing ``request_events`` after every flush and
+reloading every live row each ``RESYNC_INTERVAL``. Request ids are handed out
+in memory, so only one process should book through this backend, and up to
+``FLUSH_INTERVAL`` seconds of writes are lost if that process dies.
+
+``tests/test_parity.py`` replays one random workload against this backend
+and plain SQLite and diffs every result, read and persisted row;
+``tests/test_contention.py`` runs the races on it.
+"""
+import atexit
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+
+from . import changes, db, expiry, history, matching, spatial
+from .request_manager import REQUEST_TTL, RequestManager
+
+FLUSH_INTERVAL = 0.1     # seconds between journal flushes
+RESYNC_INTERVAL = 30     # seconds between full reloads of the live rows
+LIVE = ('pending', 'accepted')
+
+
+class _StoreMatcher(matching.SharedRideMatcher):
+    """Shared-ride matcher fed from the store instead of the database."""
+    def __init__(self, store):
+        self.store = store
+        super().__init__(store.db_name)
+
+    def refresh(self):
+        with self._lock:
+            version = self.store.shared_version
+            if version != self._version:
+                self._load(self.store.open_shared_rides())
+                self._version = version
+
+
+class MemoryRequestManager(RequestManager):
+    """``RequestManager`` over in-memory indexes, persisted through a write-behind journal."""
+    def __init__(self, db_name=None, stops=None, flush_interval=FLUSH_INTERVAL, resync_interval=RESYNC_INTERVAL):
+        super().__init__(db_name, stops)
+        self.flush_interval = flush_interval
+        self.resync_interval = resync_interval
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._journal = []          # (request ids, write(session) -> bool, channels)
+        self._dirty = Counter()     # request id -> journal entries not yet on disk
+        self.by_id = {}
+        self.by_passenger = {}
+        self.by_driver = {}
+        self.by_vehicle_status = defaultdict(dict)
+        self.shared_version = 0
+        self._matcher = _StoreMatcher(self)
+        self.rebuild()
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._run, name='ridesync-write-behind', daemon=True)
+        self._flusher.start()
+
+    # --- indexes ---
+
+    def _unindex(self, row):
+        req_id = row['id']
+        for index, key in ((self.by_passenger, row['passenger']), (self.by_driver, row['driver'])):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(req_id)
+                if not ids:
+                    del index[key]
+        self.by_vehicle_status[(row['vehicle'], row['status'])].pop(req_id, None)
+
+    def _put(self, row):
+        """Replace a request's row; terminal rows simply leave the indexes."""
+        old = self.by_id.pop(row['id'], None)
+        if old is not None:
+            self._unindex(old)
+        if row['status'] in LIVE:
+            self.by_id[row['id']] = row
+            self.by_passenger.setdefault(row['passenger'], set()).add(row['id'])
+            if row['driver']:
+                self.by_driver.setdefault(row['driver'], set()).add(row['id'])
+            self.by_vehicle_status[(row['vehicle'], row['status'])][row['id']] = row
+        if 'Shared' in (row['ride_type'], old and old['ride_type']):
+            self.shared_version += 1
+
+    def _drop(self, req_id):
+        old = self.by_id.pop(req_id, None)
+        if old is not None:
+            self._unindex(old)
+            if old['ride_type'] == 'Shared':
+                self.shared_version += 1
+
+    def _apply(self, rows, live_ids=None):
+        """Take database rows for every request without unflushed writes; with ``live_ids``, drop the rest."""
+        with self._lock:
+            for req_id, row in rows.items():
+                if self._dirty[req_id]:
+                    continue
+                if row is None:
+                    self._drop(req_id)
+                else:
+                    self._put(dict(row))
+            if live_ids is not None:
+                for req_id in [i for i in self.by_id if i not in live_ids and not self._dirty[i]]:
+                    self._drop(req_id)
+
+    def rebuild(self):
+        """Load every live request from the database (and where to tail the event log from)."""
+        with db.session(self.db_name) as s:
+            # Take the position first: replaying events we already hold is harmless
+            self._seq = s.fetchone('request_events_floor')['latest'] or 0
+            rows = s.fetchall('live_requests')
+            self._next_id = s.fetchone('max_request_id')['id'] + 1
+        self._apply({r['id']: r for r in rows}, live_ids={r['id'] for r in rows})
+
+    def resync(self):
+        """Reload the live rows, picking up completions and seat changes made elsewhere."""
+        # Under the flush lock, so no write lands between this read and applying it
+        with self._flush_lock:
+            rows = db.fetchall('live_requests', db_name=self.db_name)
+            self._apply({r['id']: r for r in rows}, live_ids={r['id'] for r in rows})
+
+    def sync(self):
+        """Reload the requests named in the event log since the last call; returns how many."""
+        with self._flush_lock, db.session(self.db_name) as s:
+            events = s.fetchall('request_event_ids_after', (self._seq,))
+            if not events:
+                return 0
+            rows = {}
+            for req_id in {e['request_id'] for e in events}:
+                row = rows[req_id] = s.fetchone('request_by_id', (req_id,))
+                # A cancelled join gives its seat back to the ride it joined
+                if row is not None and row['joined_ride_id'] is not None:
+                    rows[row['joined_ride_id']] = s.fetchone('request_by_id', (row['joined_ride_id'],))
+            self._apply(rows)
+            self._seq = events[-1]['seq']
+        return len(rows)
+
+    # --- write-behind journal ---
+
+    def _log(self, req_ids, write, channels):
+        self._journal.append((req_ids, write, channels))
+        self._dirty.update(req_ids)
+
+    def flush(self):
+        """Write every journalled mutation to SQLite now; returns how many were applied."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._journal = self._journal, []
+            if not batch:
+                return 0
+            applied, lost = 0, set()
+            try:
+                with db.transaction(self.db_name) as s:
+                    for req_ids, write, channels in batch:
+                        s.conn.execute("SAVEPOINT journal_entry")
+                        try:
+                            ok = write(s)
+                        except sqlite3.IntegrityError:
+                            ok = False      # e.g. another process booked under the same id
+                        if ok:
+                            changes.bump(s, channels)
+                            applied += 1
+                        else:
+                            s.conn.execute("ROLLBACK TO journal_entry")
+                            lost.update(req_ids)
+                        s.conn.execute("RELEASE journal_entry")
+            except sqlite3.OperationalError:
+                # Locked past busy_timeout: keep the batch, in order, for the next flush
+                with self._lock:
+                    self._journal[:0] = batch
+                return 0
+            with self._lock:
+                for req_ids, _, _ in batch:
+                    self._dirty.subtract(req_ids)
+                self._dirty += Counter()    # drop ids that are clean again
+            if lost:
+                self._reconcile(lost)
+            return applied
+
+    def _reconcile(self, req_ids):
+        """The database rejected writes to ``req_ids``: reload them and tell their viewers."""
+        with self._lock:
+            stale = [self.by_id[i] for i in req_ids if i in self.by_id]
+        with db.transaction(self.db_name) as s:
+            rows = {i: s.fetchone('request_by_id', (i,)) for i in req_ids}
+            changes.bump(s, [ch for row in [*stale, *filter(None, rows.values())] for ch in changes.channels_for(row)])
+            next_id = s.fetchone('max_request_id')['id'] + 1
+        self._apply(rows)
+        with self._lock:
+            self._next_id = max(self._next_id, next_id)
+
+    def _run(self):
+        next_resync = time.time() + self.resync_interval
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+            self.sync()
+            if time.time() >= next_resync:
+                self.resync()
+                next_resync = time.time() + self.resync_interval
+
+    def close(self):
+        """Stop the flusher, write whatever is still journalled and forget the store."""
+        self._stopped.set()
+        self._flusher.join()
+        self.flush()
+        with _stores_lock:
+            if _stores.get(self.db_name) is self:
+                del _stores[self.db_name]
+
+    # --- mutations ---
+
+    def _open_request(self, passenger):
+        """The passenger's newest accepted or unexpired pending request (caller holds the lock)."""
+        now = time.time()
+        rows = (self.by_id[i] for i in self.by_passenger.get(passenger, ()))
+        return max((r for r in rows if r['status'] == 'accepted' or r['expiry_time'] > now), key=lambda r: r['id'], default=None)
+
+    def _book(self, passenger, pickup, destination, vehicle, price, ride_type, max_passengers, joined_ride_id=None):
+        if self._open_request(passenger) is not None:
+            return None
+        pickup_pt, dest_pt = self.stops.point(pickup), self.stops.point(destination)
+        req_id, self._next_id = self._next_id, self._next_id + 1
+        row = {
+            'id': req_id, 'passenger': passenger, 'pickup': self.stops.name(pickup), 'destination': self.stops.name(destination),
+            'vehicle': vehicle, 'price': float(price), 'status': 'pending', 'driver': None, 'expiry_time': time.time() + REQUEST_TTL,
+            'ride_type': ride_type, 'current_passengers': 1, 'max_passengers': max_passengers,
+            'pickup_lat': pickup_pt[0], 'pickup_lon': pickup_pt[1], 'pickup_cell': spatial.cell(*pickup_pt),
+            'dest_lat': dest_pt[0], 'dest_lon': dest_pt[1], 'dest_cell': spatial.cell(*dest_pt),
+            'joined_ride_id': joined_ride_id,
+        }
+        self._put(row)
+        return row
+
+    @staticmethod
+    def _insert(s, row):
+        params = (row['id'], row['passenger'], row['pickup'], row['destination'], row['vehicle'], row['price'],
+                  row['expiry_time'], row['ride_type'], row['max_passengers'], row['pickup_lat'], row['pickup_lon'],
+                  row['pickup_cell'], row['dest_lat'], row['dest_lon'], row['dest_cell'], row['joined_ride_id'],
+                  row['passenger'], time.time())
+        return s.execute('book_request_as', params).rowcount == 1
+
+    def book_request(self, passenger, pickup, destination, vehicle, price, ride_type, max_passengers):
+        with self._lock:
+            row = self._book(passenger, pickup, destination, vehicle, price, ride_type, max_passengers)
+            if row is None:
+                return False
+            self._log([row['id']], lambda s: self._insert(s, row), changes.channels_for(row))
+        expiry.notify(row['id'], row['expiry_time'], self.db_name)
+        return True
+
+    def join_request(self, ride_id, passenger, pickup, destination, vehicle, price, max_passengers=4):
+        with self._lock:
+            ride = self.by_id.get(ride_id)
+            if ride is None or ride['ride_type'] != 'Shared' or ride['current_passengers'] >= ride['max_passengers']:
+                return False
+            row = self._book(passenger, pickup, destination, vehicle, price, 'Shared', max_passengers, ride_id)
+            if row is None:
+                return False
+            ride = dict(ride, current_passengers=ride['current_passengers'] + 1)
+            self._put(ride)
+            self._log([ride_id, row['id']], lambda s: s.execute('claim_seat', (ride_id,)).rowcount == 1 and self._insert(s, row),
+                      changes.channels_for(row) + changes.channels_for(ride))
+        expiry.notify(row['id'], row['expiry_time'], self.db_name)
+        return True
+
+    def _transition(self, req_id, allowed, update, name, params, extra=None, also=()):
+        """Apply ``update`` to a live row whose status is ``allowed`` and journal ``name``; returns the new row or None.
+
+        ``extra(session, row)`` runs in the same savepoint once the statement has won;
+        ``also`` lists other requests the write changes in the database.
+        """
+        with self._lock:
+            row = self.by_id.get(req_id)
+            if row is None or row['status'] != allowed:
+                return None
+            new = dict(row, **update)
+            self._put(new)
+            write = lambda s: s.execute(name, params).rowcount == 1 and (extra is None or extra(s, new) or True)
+            self._log([req_id, *also], write, changes.channels_for(new))
+            return new
+
+    def accept_request(self, req_id, driver_user):
+        now = time.time()
+        with self._lock:
+            row = self.by_id.get(req_id)
+            if row is None or row['expiry_time'] <= now:
+                return False
+            return self._transition(req_id, 'pending', {'status': 'accepted', 'driver': driver_user},
+                                    'accept_request', (driver_user, req_id, now)) is not None
+
+    def complete_request(self, req_id):
+        return self._transition(req_id, 'accepted', {'status': 'completed'}, 'complete_request', (req_id,)) is not None
+
+    def complete_ride(self, req_id):
+        def record(s, ride):
+            ride_data = {'from': ride['pickup'], 'to': ride['destination'], 'vehicle': ride['vehicle'],
+                         'price': ride['price'], 'sharing': ride['ride_type'] == 'Shared', 'timestamp': completed_at}
+            history.record_ride(s, ride['passenger'], ride_data)
+            history.record_ride(s, ride['driver'], ride_data)
+        completed_at = time.time()
+        return self._transition(req_id, 'accepted', {'status': 'completed'}, 'complete_request', (req_id,), record)
+
+    def cancel_request(self, req_id):
+        with self._lock:
+            row = self.by_id.get(req_id)
+            ride = self.by_id.get(row['joined_ride_id']) if row is not None else None
+            if self._transition(req_id, 'pending', {'status': 'cancelled'}, 'cancel_request', (req_id,),
+                                also=[ride['id']] if ride is not None else ()) is None:
+                return False
+            # Mirrors trg_release_joined_seat, which the flushed UPDATE fires in the database
+            if ride is not None and ride['current_passengers'] > 1:
+                self._put(dict(ride, current_passengers=ride['current_passengers'] - 1))
+            return True
+
+    # --- reads ---
+
+    def get_pending_requests(self, vehicle_filter, near=None, radius_km=spatial.NEARBY_KM):
+        now = time.time()
+        with self._lock:
+            newest = {}
+            for row in self.by_vehicle_status[(vehicle_filter, 'pending')].values():
+                if row['expiry_time'] > now and row['id'] > newest.get(row['passenger'], {'id': -1})['id']:
+                    newest[row['passenger']] = row
+            riding = lambda p: any(self.by_id[i]['status'] == 'accepted' for i in self.by_passenger[p])
+            rows = sorted((r for p, r in newest.items() if not riding(p)), key=lambda r: r['id'])
+        if near is None:
+            return rows
+        point = self.stops.point(near)
+        return [r for r in rows if r['pickup_lat'] is not None
+                and spatial.haversine_km(point, (r['pickup_lat'], r['pickup_lon'])) <= radius_km]
+
+    def get_driver_active_rides(self, driver_username):
+        with self._lock:
+            return [self.by_id[i] for i in sorted(self.by_driver.get(driver_username, ())) if self.by_id[i]['status'] == 'accepted']
+
+    def get_passenger_active_request(self, passenger_user):
+        with self._lock:
+            return self._open_request(passenger_user)
+
+    def open_shared_rides(self):
+        with self._lock:
+            return [r for _, r in sorted(self.by_id.items())
+                    if r['ride_type'] == 'Shared' and r['current_passengers'] < r['max_passengers']]
+
+    def find_matching_rides(self, destination, radius_km=None, pickup=None, k=matching.TOP_K):
+        if pickup is not None:
+            ranked = self._matcher.top_k(self.stops.point(pickup), self.stops.point(destination), k)
+            return [dict(self._match(r), detour_km=detour) for r, detour in ranked]
+        rows = self.open_shared_rides()
+        if radius_km is None and isinstance(destination, str):
+            rows = [r for r in rows if r['destination'] == destination]
+        else:
+            radius_km = radius_km or spatial.NEARBY_KM
+            point = self.stops.point(destination)
+            rows = [r for r in rows if r['dest_lat'] is not None
+                    and spatial.haversine_km(point, (r['dest_lat'], r['dest_lon'])) <= radius_km]
+        return [self._match(r) for r in rows]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_name=None, stops=None):
+    """The process-wide store for a database, built (and flushed at exit) on first use."""
+    key = db_name or db.DB_NAME
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = MemoryRequestManager(db_name, stops)
+            atexit.register(store.flush)
+    return store
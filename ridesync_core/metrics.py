@@ -0,0 +1,223 @@
+"""Timing histograms and counters for the hot paths, exported as Prometheus text.
+
+Off unless ``RIDESYNC_METRICS=1``. While off, ``timer`` hands back one shared
+no-op context, ``count`` returns at once, ``timed`` leaves the function
+untouched and the database layer skips timing behind a single flag test.
+
+What is measured, when on:
+
+* ``ridesync_query_seconds{query}`` -- every named statement (``db.Session``)
+  and the pandas history reads;
+* ``ridesync_route_seconds{backend}`` -- route lookups per backend; for
+  ``osrm`` the network fetch alone is ``ridesync_route_fetch_seconds``;
+* ``ridesync_cache_requests_total{cache}`` / ``ridesync_cache_misses_total{cache}``
+  -- the route cache, the fare table and the app's route and map caches;
+* ``ridesync_render_seconds{what}`` -- folium map rendering;
+* ``ridesync_worker_seconds{task}`` -- expiry, archive and dispatch rounds,
+  and ``ridesync_worker_errors_total{task}`` for rounds that failed;
+* ``ridesync_lock_wait_seconds`` -- transactions that waited for the write lock;
+* ``ridesync_rerun_seconds{scope}`` / ``ridesync_reruns_total{scope}`` --
+  full script runs (runs cut short by ``st.rerun()`` are counted but not
+  timed; the app also keeps a per-session count), and
+  ``ridesync_fragment_seconds{fragment}`` for the polling fragments.
+
+``render()`` returns the Prometheus text exposition. ``start()`` (called once
+by the app) rewrites the file at ``RIDESYNC_METRICS_FILE`` every
+``DUMP_INTERVAL`` seconds and/or serves ``/metrics`` on
+``RIDESYNC_METRICS_PORT``. ``RIDESYNC_DEBUG_PANEL=1`` adds a metrics panel
+to the app's sidebar.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+ENABLED = os.environ.get('RIDESYNC_METRICS', '0') == '1'
+DEBUG_PANEL = ENABLED and os.environ.get('RIDESYNC_DEBUG_PANEL', '0') == '1'
+METRICS_FILE = os.environ.get('RIDESYNC_METRICS_FILE')
+METRICS_PORT = os.environ.get('RIDESYNC_METRICS_PORT')
+DUMP_INTERVAL = 15   # seconds between rewrites of METRICS_FILE
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Counts of observations per ``BUCKETS`` upper bound, plus their sum."""
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)    # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile (inf past the last bucket)."""
+        rank, seen = q * self.count, 0
+        for bound, n in zip((*BUCKETS, float('inf')), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+_histograms = {}     # (name, labels) -> Histogram
+_counters = {}       # (name, labels) -> int
+_lock = threading.Lock()
+_NOOP = nullcontext()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+def count(name, n=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name, self.labels = name, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def timer(name, **labels):
+    """Context manager adding the block's duration to histogram ``name``."""
+    return _Timer(name, labels) if ENABLED else _NOOP
+
+
+def timed(name, **labels):
+    """Decorator timing every call of the function (exceptions included)."""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Timer(name, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{str(v)}"' for k, v in pairs) + '}'
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {key: (list(h.counts), h.sum, h.count) for key, h in _histograms.items()}
+        counters = dict(_counters)
+    lines, typed = [], set()
+    for (name, labels), (counts, total, n) in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f'# TYPE {name} histogram')
+            typed.add(name)
+        cumulative = 0
+        for bound, c in zip((*BUCKETS, '+Inf'), counts):
+            cumulative += c
+            lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {total:.6f}')
+        lines.append(f'{name}_count{_labels(labels)} {n}')
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typed:
+            lines.append(f'# TYPE {name} counter')
+            typed.add(name)
+        lines.append(f'{name}{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    """One row per histogram series, for the debug panel: count, mean and bucketed p50/p95/p99 in ms."""
+    with _lock:
+        rows = [(name, labels, h.count, h.sum, [h.quantile(q) for q in (0.5, 0.95, 0.99)])
+                for (name, labels), h in _histograms.items()]
+    return [{'metric': name, 'labels': ', '.join(f'{k}={v}' for k, v in labels), 'count': n,
+             'mean_ms': round(total / n * 1000, 3) if n else 0.0,
+             **{f'p{p}_ms': q * 1000 for p, q in zip((50, 95, 99), quantiles)}}
+            for name, labels, n, total, quantiles in sorted(rows)]
+
+
+def dump(path):
+    """Write ``render()`` to ``path`` atomically."""
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+def _serve(port):
+    """Serve ``/metrics`` on ``port`` from a daemon thread (http.server is imported only here)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    threading.Thread(target=server.serve_forever, name='ridesync-metrics-http', daemon=True).start()
+
+
+def _dump_forever(path, interval):
+    while True:
+        time.sleep(interval)
+        dump(path)
+
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def start(path=METRICS_FILE, port=METRICS_PORT, interval=DUMP_INTERVAL):
+    """Start the file dumper and/or the ``/metrics`` endpoint, once per process (nothing while disabled)."""
+    global _started
+    with _start_lock:
+        if _started or not ENABLED:
+            return
+        _started = True
+    if path:
+        threading.Thread(target=_dump_forever, args=(path, interval), name='ridesync-metrics-dump', daemon=True).start()
+    if port:
+        _serve(int(port))
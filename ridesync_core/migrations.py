@@ -0,0 +1,237 @@
+"""Versioned schema migrations.
+
+The schema version lives in ``PRAGMA user_version``. Each entry in
+``MIGRATIONS`` moves the database up by one version and runs in its own
+``BEGIN IMMEDIATE`` transaction, so several processes starting at once
+apply every step exactly once. Request shards (``ridesync_core.shards``)
+get the same schema as the main database and are migrated along with it.
+
+Run ``python -m ridesync_core.migrations [db]`` to migrate a database;
+``tests/test_migrations.py`` checks that none of the hot queries falls back
+to a full table scan.
+"""
+import sys
+
+from . import db, shards
+
+MIGRATIONS = [
+    # 1: base tables (what init_db used to create inline)
+    [
+        '''CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS rides (
+            id INTEGER PRIMARY KEY, username TEXT, source TEXT, destination TEXT,
+            vehicle TEXT, ride_type TEXT, price REAL, status TEXT, timestamp REAL)''',
+        '''CREATE TABLE IF NOT EXISTS active_requests (
+            id INTEGER PRIMARY KEY, passenger TEXT, pickup TEXT, destination TEXT,
+            vehicle TEXT, price REAL, status TEXT, driver TEXT,
+            expiry_time REAL, ride_type TEXT, current_passengers INTEGER, max_passengers INTEGER)''',
+    ],
+    # 2: indexes for the polling queries
+    [
+        # get_pending_requests: newest pending row per passenger for a vehicle
+        '''CREATE INDEX IF NOT EXISTS idx_requests_pending_vehicle
+            ON active_requests (vehicle, passenger, expiry_time) WHERE status = 'pending' ''',
+        # expiry worker and per-passenger duplicate cleanup
+        '''CREATE INDEX IF NOT EXISTS idx_requests_pending_expiry
+            ON active_requests (expiry_time) WHERE status = 'pending' ''',
+        '''CREATE INDEX IF NOT EXISTS idx_requests_pending_passenger
+            ON active_requests (passenger) WHERE status = 'pending' ''',
+        # driver's current rides, and the "passenger already accepted" check
+        '''CREATE INDEX IF NOT EXISTS idx_requests_accepted_driver
+            ON active_requests (driver) WHERE status = 'accepted' ''',
+        '''CREATE INDEX IF NOT EXISTS idx_requests_accepted_passenger
+            ON active_requests (passenger) WHERE status = 'accepted' ''',
+        # passenger's open booking
+        '''CREATE INDEX IF NOT EXISTS idx_requests_open_passenger
+            ON active_requests (passenger, status) WHERE status IN ('pending', 'accepted')''',
+        # shared-ride matching
+        '''CREATE INDEX IF NOT EXISTS idx_requests_open_shared_destination
+            ON active_requests (destination, current_passengers, max_passengers)
+            WHERE ride_type = 'Shared' AND status IN ('pending', 'accepted')''',
+        # history page, stats and retention
+        '''CREATE INDEX IF NOT EXISTS idx_rides_username_timestamp
+            ON rides (username, timestamp)''',
+    ],
+    # 3: change counters polled by waiting sessions
+    [
+        '''CREATE TABLE IF NOT EXISTS change_versions (
+            channel TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID''',
+    ],
+    # 4: cold storage for completed/cancelled requests, bucketed by day
+    [
+        '''CREATE TABLE IF NOT EXISTS archived_requests (
+            id INTEGER PRIMARY KEY, passenger TEXT, pickup TEXT, destination TEXT,
+            vehicle TEXT, price REAL, status TEXT, driver TEXT,
+            expiry_time REAL, ride_type TEXT, current_passengers INTEGER, max_passengers INTEGER,
+            day TEXT, archived_at REAL)''',
+        '''CREATE INDEX IF NOT EXISTS idx_archived_day ON archived_requests (day)''',
+        '''CREATE INDEX IF NOT EXISTS idx_archived_passenger ON archived_requests (passenger, day)''',
+        '''CREATE INDEX IF NOT EXISTS idx_archived_driver ON archived_requests (driver, day)''',
+        '''CREATE INDEX IF NOT EXISTS idx_requests_terminal
+            ON active_requests (status) WHERE status IN ('completed', 'cancelled')''',
+        '''CREATE VIEW IF NOT EXISTS all_requests AS
+            SELECT id, passenger, pickup, destination, vehicle, price, status, driver,
+                   expiry_time, ride_type, current_passengers, max_passengers
+            FROM active_requests
+            UNION ALL
+            SELECT id, passenger, pickup, destination, vehicle, price, status, driver,
+                   expiry_time, ride_type, current_passengers, max_passengers
+            FROM archived_requests''',
+    ],
+    # 5: persistent OSRM route cache, keyed by rounded (lat, lon) pair
+    [
+        '''CREATE TABLE IF NOT EXISTS route_cache (
+            src TEXT, dst TEXT, version INTEGER, distance_km REAL, geometry TEXT, fetched_at REAL,
+            PRIMARY KEY (src, dst))''',
+    ],
+    # 6: coordinates and grid cells for radius queries on arbitrary points
+    [
+        *(f'''ALTER TABLE {table} ADD COLUMN {column}'''
+          for table in ('active_requests', 'archived_requests')
+          for column in ('pickup_lat REAL', 'pickup_lon REAL', 'pickup_cell INTEGER',
+                         'dest_lat REAL', 'dest_lon REAL', 'dest_cell INTEGER')),
+        '''CREATE INDEX IF NOT EXISTS idx_requests_pending_vehicle_cell
+            ON active_requests (vehicle, pickup_cell) WHERE status = 'pending' ''',
+        '''CREATE INDEX IF NOT EXISTS idx_requests_open_shared_dest_cell
+            ON active_requests (dest_cell) WHERE ride_type = 'Shared' AND status IN ('pending', 'accepted')''',
+    ],
+    # 7: joins point at the shared ride whose seat they took; the seat is
+    #    handed back if the join is cancelled or expires before pickup
+    [
+        '''ALTER TABLE active_requests ADD COLUMN joined_ride_id INTEGER''',
+        '''ALTER TABLE archived_requests ADD COLUMN joined_ride_id INTEGER''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_release_joined_seat
+            AFTER UPDATE OF status ON active_requests
+            WHEN OLD.status = 'pending' AND NEW.status = 'cancelled' AND NEW.joined_ride_id IS NOT NULL
+            BEGIN
+                UPDATE active_requests SET current_passengers = current_passengers - 1
+                WHERE id = NEW.joined_ride_id AND current_passengers > 1;
+            END''',
+    ],
+    # 8: central dispatch -- drivers announce themselves, the dispatcher writes offers
+    [
+        '''CREATE TABLE IF NOT EXISTS driver_presence (
+            driver TEXT PRIMARY KEY, vehicle TEXT, lat REAL, lon REAL, last_seen REAL) WITHOUT ROWID''',
+        '''CREATE INDEX IF NOT EXISTS idx_driver_presence_seen ON driver_presence (last_seen)''',
+        '''CREATE TABLE IF NOT EXISTS offers (
+            request_id INTEGER, driver TEXT, status TEXT, expires_at REAL,
+            PRIMARY KEY (request_id, driver)) WITHOUT ROWID''',
+        '''CREATE INDEX IF NOT EXISTS idx_offers_live_driver
+            ON offers (driver, expires_at) WHERE status = 'offered' ''',
+        # offers (and declines) only matter while their request is pending
+        '''CREATE TRIGGER IF NOT EXISTS trg_clear_offers
+            AFTER UPDATE OF status ON active_requests
+            WHEN OLD.status = 'pending' AND NEW.status != 'pending'
+            BEGIN
+                DELETE FROM offers WHERE request_id = NEW.id;
+            END''',
+    ],
+    # 9: append-only log of requests entering and leaving pending, for delta feeds
+    [
+        '''CREATE TABLE IF NOT EXISTS request_events (
+            seq INTEGER PRIMARY KEY, request_id INTEGER, vehicle TEXT, kind TEXT, at REAL)''',
+        '''CREATE INDEX IF NOT EXISTS idx_request_events_vehicle ON request_events (vehicle, seq)''',
+        '''CREATE INDEX IF NOT EXISTS idx_request_events_at ON request_events (at)''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_log_request_created
+            AFTER INSERT ON active_requests
+            WHEN NEW.status = 'pending'
+            BEGIN
+                INSERT INTO request_events (request_id, vehicle, kind, at)
+                VALUES (NEW.id, NEW.vehicle, 'created', (julianday('now') - 2440587.5) * 86400.0);
+            END''',
+        # closing events log the status as is: the clock cannot tell an expiry from a late
+        # cancel (the worker fires right at the deadline), so the expiry worker relabels its own
+        '''CREATE TRIGGER IF NOT EXISTS trg_log_request_closed
+            AFTER UPDATE OF status ON active_requests
+            WHEN OLD.status = 'pending' AND NEW.status != 'pending'
+            BEGIN
+                INSERT INTO request_events (request_id, vehicle, kind, at)
+                VALUES (NEW.id, NEW.vehicle, NEW.status, (julianday('now') - 2440587.5) * 86400.0);
+            END''',
+    ],
+    # 10: events carry the pickup too, so demand can be counted per zone from the log alone
+    [
+        '''ALTER TABLE request_events ADD COLUMN pickup TEXT''',
+        '''DROP TRIGGER IF EXISTS trg_log_request_created''',
+        '''DROP TRIGGER IF EXISTS trg_log_request_closed''',
+        '''CREATE TRIGGER trg_log_request_created
+            AFTER INSERT ON active_requests
+            WHEN NEW.status = 'pending'
+            BEGIN
+                INSERT INTO request_events (request_id, vehicle, pickup, kind, at)
+                VALUES (NEW.id, NEW.vehicle, NEW.pickup, 'created', (julianday('now') - 2440587.5) * 86400.0);
+            END''',
+        '''CREATE TRIGGER trg_log_request_closed
+            AFTER UPDATE OF status ON active_requests
+            WHEN OLD.status = 'pending' AND NEW.status != 'pending'
+            BEGIN
+                INSERT INTO request_events (request_id, vehicle, pickup, kind, at)
+                VALUES (NEW.id, NEW.vehicle, NEW.pickup, NEW.status, (julianday('now') - 2440587.5) * 86400.0);
+            END''',
+    ],
+    # 11: per-user ride totals and monthly rollups, kept in step with rides by triggers
+    [
+        '''CREATE TABLE IF NOT EXISTS user_stats (
+            username TEXT PRIMARY KEY, total_rides INTEGER NOT NULL, total_price REAL NOT NULL) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS user_monthly (
+            username TEXT, month TEXT, rides INTEGER NOT NULL, total_price REAL NOT NULL,
+            PRIMARY KEY (username, month)) WITHOUT ROWID''',
+        '''INSERT OR REPLACE INTO user_stats (username, total_rides, total_price)
+            SELECT username, COUNT(*), COALESCE(SUM(price), 0) FROM rides GROUP BY username''',
+        '''INSERT OR REPLACE INTO user_monthly (username, month, rides, total_price)
+            SELECT username, strftime('%Y-%m', timestamp, 'unixepoch', 'localtime'), COUNT(*), COALESCE(SUM(price), 0)
+            FROM rides GROUP BY 1, 2''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_rides_summary_insert
+            AFTER INSERT ON rides
+            BEGIN
+                INSERT INTO user_stats (username, total_rides, total_price)
+                VALUES (NEW.username, 1, COALESCE(NEW.price, 0))
+                ON CONFLICT(username) DO UPDATE SET
+                    total_rides = total_rides + 1, total_price = total_price + excluded.total_price;
+                INSERT INTO user_monthly (username, month, rides, total_price)
+                VALUES (NEW.username, strftime('%Y-%m', NEW.timestamp, 'unixepoch', 'localtime'), 1, COALESCE(NEW.price, 0))
+                ON CONFLICT(username, month) DO UPDATE SET
+                    rides = rides + 1, total_price = total_price + excluded.total_price;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_rides_summary_delete
+            AFTER DELETE ON rides
+            BEGIN
+                UPDATE user_stats SET total_rides = total_rides - 1, total_price = total_price - COALESCE(OLD.price, 0)
+                WHERE username = OLD.username;
+                UPDATE user_monthly SET rides = rides - 1, total_price = total_price - COALESCE(OLD.price, 0)
+                WHERE username = OLD.username AND month = strftime('%Y-%m', OLD.timestamp, 'unixepoch', 'localtime');
+            END''',
+    ],
+    # 12: date-range exports across all users
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_rides_timestamp ON rides (timestamp)''',
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(db_name=None):
+    """Bring the database and its request shards up to ``SCHEMA_VERSION``; returns the main file's final version."""
+    layout = shards.layout(db_name)
+    for shard in layout.names:
+        if shard != layout.db_name:
+            _migrate(shard)
+    return _migrate(layout.db_name)
+
+
+def _migrate(db_name):
+    while True:
+        with db.transaction(db_name) as s:
+            version = s.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                break
+            for statement in MIGRATIONS[version]:
+                s.conn.execute(statement)
+            s.conn.execute(f"PRAGMA user_version = {version + 1}")
+    with db.connection(db_name) as conn:
+        conn.execute("PRAGMA optimize")
+    return version
+
+
+if __name__ == '__main__':
+    print(f"schema version {migrate(sys.argv[1] if len(sys.argv) > 1 else None)}")
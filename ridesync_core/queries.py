@@ -0,0 +1,257 @@
+"""Named SQL statements used across the app.
+
+Keeping every statement in one place means each pooled connection sees the
+exact same SQL text on every call, so sqlite3's per-connection statement
+cache hands back an already-prepared statement instead of re-parsing it.
+"""
+
+SQL = {
+    # --- users ---
+    'user_password': "SELECT password FROM users WHERE username = ?",
+    'insert_user': "INSERT INTO users VALUES (?, ?)",
+    'insert_user_if_missing': "INSERT OR IGNORE INTO users VALUES (?, ?)",
+
+    # --- rides (history) ---
+    # Everything past a user's newest N rides; walks at most N+1 index entries
+    'trim_rides': """
+        DELETE FROM rides WHERE id IN (
+            SELECT id FROM rides WHERE username = ? ORDER BY timestamp DESC LIMIT -1 OFFSET ?
+        )
+    """,
+    # Bulk export: every user's rides in a time range, oldest first, keyset on (timestamp, id)
+    'rides_between_page': """
+        SELECT * FROM rides
+        WHERE (timestamp, id) > (?, ?) AND timestamp < ?
+        ORDER BY timestamp, id
+        LIMIT ?
+    """,
+    'users_over_limit': "SELECT username FROM user_stats WHERE total_rides > ?",
+    'insert_ride': """
+        INSERT INTO rides (username, source, destination, vehicle, ride_type, price, status, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+    'user_rides': "SELECT * FROM rides WHERE username = ? ORDER BY timestamp DESC",
+    # Keyset pagination: the (timestamp, id) of the last row seen is the cursor
+    'user_rides_page': """
+        SELECT id, source, destination, vehicle, ride_type, price, status, timestamp FROM rides
+        WHERE username = ? AND (timestamp, id) < (?, ?)
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    """,
+    # Summary rows are maintained by triggers on rides (migration 11)
+    'user_stats': "SELECT total_rides, total_price FROM user_stats WHERE username = ?",
+    'user_monthly': "SELECT month, rides, total_price FROM user_monthly WHERE username = ? AND rides > 0 ORDER BY month",
+    'user_ride_count': "SELECT COUNT(*) FROM rides WHERE username = ?",
+
+    # --- active_requests ---
+    # Books only if the passenger (last parameter) has no open request -- one statement, no race.
+    # The id is the shard's max id plus the shard count (first two parameters), so it encodes the shard
+    'book_request': """
+        INSERT INTO active_requests (id, passenger, pickup, destination, vehicle, price, status, driver, expiry_time, ride_type, current_passengers, max_passengers,
+                                     pickup_lat, pickup_lon, pickup_cell, dest_lat, dest_lon, dest_cell, joined_ride_id)
+        SELECT (SELECT COALESCE(MAX(id), ?) FROM active_requests) + ?, ?, ?, ?, ?, ?, 'pending', NULL, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (
+            SELECT 1 FROM active_requests WHERE passenger = ? AND status IN ('pending', 'accepted')
+            AND (status = 'accepted' OR expiry_time > ?)
+        )
+    """,
+    # Write-behind booking from the in-memory store: the id was handed out in memory
+    'book_request_as': """
+        INSERT INTO active_requests (id, passenger, pickup, destination, vehicle, price, status, driver, expiry_time, ride_type, current_passengers, max_passengers,
+                                     pickup_lat, pickup_lon, pickup_cell, dest_lat, dest_lon, dest_cell, joined_ride_id)
+        SELECT ?, ?, ?, ?, ?, ?, 'pending', NULL, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (
+            SELECT 1 FROM active_requests WHERE passenger = ? AND status IN ('pending', 'accepted')
+            AND (status = 'accepted' OR expiry_time > ?)
+        )
+    """,
+    'live_requests': "SELECT * FROM active_requests WHERE status IN ('pending', 'accepted')",
+    'max_request_id': "SELECT MAX(COALESCE((SELECT MAX(id) FROM active_requests), 0), COALESCE((SELECT MAX(id) FROM archived_requests), 0)) AS id",
+    'pending_requests': """
+        SELECT * FROM active_requests
+        WHERE id IN (
+            SELECT MAX(id) FROM active_requests
+            WHERE status = 'pending'
+            AND vehicle = ?
+            AND expiry_time > ?
+            GROUP BY passenger
+        )
+        AND passenger NOT IN (
+            SELECT passenger FROM active_requests WHERE status = 'accepted'
+        )
+        ORDER BY id ASC
+    """,
+    # Cell ids arrive as one JSON array parameter so the statement text never changes
+    'pending_requests_near': """
+        SELECT * FROM active_requests
+        WHERE id IN (
+            SELECT MAX(id) FROM active_requests
+            WHERE status = 'pending'
+            AND vehicle = ?
+            AND pickup_cell IN (SELECT value FROM json_each(?))
+            AND expiry_time > ?
+            GROUP BY passenger
+        )
+        AND passenger NOT IN (
+            SELECT passenger FROM active_requests WHERE status = 'accepted'
+        )
+        ORDER BY id ASC
+    """,
+    'driver_active_rides': "SELECT * FROM active_requests WHERE driver = ? AND status = 'accepted'",
+    # An expired request stops blocking its passenger even if the expiry worker has not got to it
+    'passenger_active_request': """
+        SELECT * FROM active_requests
+        WHERE passenger = ? AND status IN ('pending', 'accepted')
+        AND (status = 'accepted' OR expiry_time > ?)
+        ORDER BY id DESC LIMIT 1
+    """,
+    'matching_rides': """
+        SELECT * FROM active_requests
+        WHERE destination = ?
+        AND ride_type = 'Shared'
+        AND status IN ('pending', 'accepted')
+        AND current_passengers < max_passengers
+    """,
+    'matching_rides_near': """
+        SELECT * FROM active_requests
+        WHERE dest_cell IN (SELECT value FROM json_each(?))
+        AND ride_type = 'Shared'
+        AND status IN ('pending', 'accepted')
+        AND current_passengers < max_passengers
+    """,
+    'open_shared_rides': """
+        SELECT id, pickup, destination, vehicle, price, driver, current_passengers, max_passengers,
+               pickup_lat, pickup_lon, dest_lat, dest_lon
+        FROM active_requests
+        WHERE ride_type = 'Shared'
+        AND status IN ('pending', 'accepted')
+        AND current_passengers < max_passengers
+    """,
+    # State transitions are compare-and-set: rowcount 1 means this caller won
+    'accept_request': "UPDATE active_requests SET status = 'accepted', driver = ? WHERE id = ? AND status = 'pending' AND expiry_time > ?",
+    'complete_request': "UPDATE active_requests SET status = 'completed' WHERE id = ? AND status = 'accepted'",
+    'cancel_request': "UPDATE active_requests SET status = 'cancelled' WHERE id = ? AND status = 'pending'",
+    'claim_seat': """
+        UPDATE active_requests SET current_passengers = current_passengers + 1
+        WHERE id = ? AND ride_type = 'Shared' AND status IN ('pending', 'accepted')
+        AND current_passengers < max_passengers
+    """,
+    'request_channels': "SELECT passenger, vehicle, driver, ride_type FROM active_requests WHERE id = ?",
+    'request_by_id': "SELECT * FROM active_requests WHERE id = ?",
+    'duplicate_requests': """
+        SELECT passenger, vehicle, driver, ride_type FROM active_requests
+        WHERE status = 'pending'
+        AND id NOT IN (
+            SELECT MAX(id) FROM active_requests
+            WHERE status = 'pending'
+            GROUP BY passenger
+        )
+    """,
+    'pending_expiries': "SELECT id, expiry_time FROM active_requests WHERE status = 'pending'",
+    'expire_request': "UPDATE active_requests SET status = 'cancelled' WHERE id = ? AND status = 'pending' AND expiry_time <= ?",
+    # Run right after expire_request in the same transaction: its closing event is the newest row
+    'mark_expired': "UPDATE request_events SET kind = 'expired' WHERE seq = (SELECT MAX(seq) FROM request_events) AND request_id = ?",
+    'cancel_duplicate_requests': """
+        UPDATE active_requests SET status = 'cancelled'
+        WHERE status = 'pending'
+        AND id NOT IN (
+            SELECT MAX(id) FROM active_requests
+            WHERE status = 'pending'
+            GROUP BY passenger
+        )
+    """,
+
+    # --- archive ---
+    # The newest row always stays behind: active_requests has no AUTOINCREMENT,
+    # so removing the max rowid would let SQLite hand out an archived id again.
+    'terminal_request_ids': """
+        SELECT id FROM active_requests
+        WHERE status IN ('completed', 'cancelled')
+        AND id < (SELECT MAX(id) FROM active_requests)
+        LIMIT ?
+    """,
+    'archive_request': """
+        INSERT OR REPLACE INTO archived_requests (
+            id, passenger, pickup, destination, vehicle, price, status, driver,
+            expiry_time, ride_type, current_passengers, max_passengers,
+            pickup_lat, pickup_lon, pickup_cell, dest_lat, dest_lon, dest_cell, joined_ride_id, day, archived_at)
+        SELECT id, passenger, pickup, destination, vehicle, price, status, driver,
+               expiry_time, ride_type, current_passengers, max_passengers,
+               pickup_lat, pickup_lon, pickup_cell, dest_lat, dest_lon, dest_cell, joined_ride_id,
+               date(expiry_time, 'unixepoch'), ?
+        FROM active_requests WHERE id = ?
+    """,
+    'delete_request': "DELETE FROM active_requests WHERE id = ?",
+    'request_status_counts': "SELECT status, COUNT(*) AS requests FROM all_requests GROUP BY status",
+
+    # --- dispatch ---
+    'driver_heartbeat': "INSERT OR REPLACE INTO driver_presence (driver, vehicle, lat, lon, last_seen) VALUES (?, ?, ?, ?, ?)",
+    'driver_offline': "DELETE FROM driver_presence WHERE driver = ?",
+    # Pending requests nobody currently holds an offer for
+    'dispatch_requests': """
+        SELECT id, vehicle, pickup, pickup_lat, pickup_lon FROM active_requests r
+        WHERE status = 'pending' AND expiry_time > ?
+        AND NOT EXISTS (
+            SELECT 1 FROM offers o WHERE o.request_id = r.id AND o.status = 'offered' AND o.expires_at > ?
+        )
+    """,
+    'online_drivers': "SELECT driver, vehicle, lat, lon FROM driver_presence WHERE last_seen > ?",
+    # Which of the given drivers have a ride in progress or an offer waiting on them
+    'busy_drivers': """
+        SELECT driver FROM active_requests
+        WHERE driver IN (SELECT value FROM json_each(?)) AND status = 'accepted'
+        UNION
+        SELECT driver FROM offers
+        WHERE driver IN (SELECT value FROM json_each(?)) AND status = 'offered' AND expires_at > ?
+    """,
+    # (request, driver) pairs already tried: declined, or left to lapse
+    'stale_offers': """
+        SELECT request_id, driver FROM offers
+        WHERE request_id IN (SELECT value FROM json_each(?))
+        AND NOT (status = 'offered' AND expires_at > ?)
+    """,
+    'put_offer': "INSERT OR REPLACE INTO offers (request_id, driver, status, expires_at) VALUES (?, ?, 'offered', ?)",
+    'decline_offer': "UPDATE offers SET status = 'declined' WHERE request_id = ? AND driver = ?",
+    'driver_offers': """
+        SELECT r.*, o.expires_at AS offer_expires_at FROM offers o
+        JOIN active_requests r ON r.id = o.request_id
+        WHERE o.driver = ? AND o.status = 'offered' AND o.expires_at > ?
+        AND r.status = 'pending'
+        ORDER BY o.expires_at
+    """,
+
+    # --- request event log ---
+    'request_events_since': """
+        SELECT e.seq, e.kind, e.request_id, r.* FROM request_events e
+        LEFT JOIN active_requests r ON r.id = e.request_id
+        WHERE e.vehicle = ? AND e.seq > ?
+        ORDER BY e.seq
+    """,
+    'request_events_floor': """
+        SELECT (SELECT MIN(seq) FROM request_events) AS oldest,
+               (SELECT MAX(seq) FROM request_events) AS latest
+    """,
+    'request_events_after': "SELECT seq, vehicle, pickup, kind, at FROM request_events WHERE seq > ? ORDER BY seq",
+    'request_event_ids_after': "SELECT seq, request_id FROM request_events WHERE seq > ? ORDER BY seq",
+    'request_event_counts': "SELECT kind, COUNT(*) AS events FROM request_events GROUP BY kind",
+    'request_events_from': "SELECT seq, vehicle, pickup, kind, at FROM request_events WHERE at >= ? ORDER BY at",
+    # Like the archive, the newest event always stays so its seq is never handed out again
+    'prune_request_events': """
+        DELETE FROM request_events
+        WHERE at < ? AND seq < (SELECT MAX(seq) FROM request_events)
+    """,
+
+    # --- route cache ---
+    'route_cache_get': """
+        SELECT distance_km, geometry FROM route_cache
+        WHERE src = ? AND dst = ? AND version = ? AND fetched_at > ?
+    """,
+    'route_cache_put': "INSERT OR REPLACE INTO route_cache (src, dst, version, distance_km, geometry, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+
+    # --- change counters ---
+    'bump_change': """
+        INSERT INTO change_versions (channel, version) VALUES (?, 1)
+        ON CONFLICT(channel) DO UPDATE SET version = version + 1
+    """,
+    'change_version': "SELECT version FROM change_versions WHERE channel = ?",
+}
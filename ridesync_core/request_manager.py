@@ -0,0 +1,260 @@
+"""Ride request lifecycle on top of the pooled SQLite layer.
+
+Every state transition is a single conditional statement run inside a
+``BEGIN IMMEDIATE`` transaction and reports whether this caller won it:
+two drivers accepting the same request, or a double-clicked Book button,
+get exactly one ``True`` between them.
+
+With ``RIDESYNC_SHARDS`` above 1 the requests are spread over several
+database files (see ``ridesync_core.shards``); each operation is routed to
+the shard that holds its request and reads that span shards gather from all
+of them.
+
+``open_manager`` picks the backend from ``RIDESYNC_REQUEST_BACKEND``: this
+module's SQLite manager (the default) or the in-memory store with
+write-behind persistence in ``ridesync_core.memory_store``.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from . import changes, db, expiry, history, matching, shards, spatial
+
+REQUEST_TTL = float(os.environ.get('RIDESYNC_REQUEST_TTL', '180'))  # seconds a pending request waits for a driver
+REQUEST_BACKEND = os.environ.get('RIDESYNC_REQUEST_BACKEND', 'sqlite')   # 'sqlite' or 'memory'
+
+
+class RequestManager:
+    """Handles real-time request syncing via SQLite"""
+    def __init__(self, db_name=None, stops=None):
+        self.db_name = db_name or db.DB_NAME
+        self.stops = stops or spatial.load_catalogue()
+        self.shards = shards.layout(self.db_name)
+
+    def create_request(self, data):
+        r_type = 'Shared' if data.get('sharing') else 'Solo'
+        max_p = 3 if data['vehicle'] == 'auto' else 4 if data['vehicle'] == 'car' else 1
+        return self.book_request(data['passenger'], data['pickup'], data['destination'], data['vehicle'], data['price'], r_type, max_p)
+
+    @contextmanager
+    def _sole_booking(self, passenger, shard):
+        """Yields whether ``passenger`` is free to book in ``shard``.
+
+        ``book_request`` itself refuses a second open request within one shard;
+        with several shards the others are checked first, under a per-passenger
+        lock so this process never books one passenger on two shards at once.
+        """
+        if self.shards.count == 1:
+            yield True
+            return
+        with self.shards.passenger_lock(passenger):
+            yield not any(db.fetchone('passenger_active_request', (passenger, time.time()), other)
+                          for other in self.shards.names if other != shard)
+
+    def _book(self, s, shard, passenger, pickup, destination, vehicle, price, ride_type, max_passengers, joined_ride_id=None):
+        pickup_pt, dest_pt = self.stops.point(pickup), self.stops.point(destination)
+        pickup, destination = self.stops.name(pickup), self.stops.name(destination)
+        expiry_time = time.time() + REQUEST_TTL
+        cur = s.execute('book_request', (*self.shards.id_params(shard), passenger, pickup, destination, vehicle, price, expiry_time, ride_type, max_passengers,
+                                         *pickup_pt, spatial.cell(*pickup_pt), *dest_pt, spatial.cell(*dest_pt), joined_ride_id,
+                                         passenger, time.time()))
+        if not cur.rowcount:
+            return None
+        changes.bump(s, changes.channels_for({'vehicle': vehicle, 'passenger': passenger, 'driver': None, 'ride_type': ride_type}))
+        return cur.lastrowid, expiry_time
+
+    def book_request(self, passenger, pickup, destination, vehicle, price, ride_type, max_passengers):
+        """Create a pending request unless the passenger already has an open one. Returns True if booked.
+
+        Refusing duplicates here is what keeps at most one open request per passenger,
+        so nothing has to sweep for duplicates afterwards. ``pickup`` and ``destination``
+        may be stop names or (lat, lon) tuples, which are stored with their nearest stop's name.
+        """
+        shard = self.shards.route(vehicle, spatial.cell(*self.stops.point(pickup)))
+        with self._sole_booking(passenger, shard) as free:
+            if not free:
+                return False
+            with db.transaction(shard) as s:
+                booked = self._book(s, shard, passenger, pickup, destination, vehicle, price, ride_type, max_passengers)
+        if booked is None:
+            return False
+        expiry.notify(*booked, self.db_name)
+        return True
+
+    def join_request(self, ride_id, passenger, pickup, destination, vehicle, price, max_passengers=4):
+        """Take a seat on shared ride ``ride_id`` and book the passenger's own request, atomically.
+
+        Returns False (and changes nothing) if the ride is full or gone, or the passenger
+        already has an open request. The passenger's request goes to the ride's shard.
+        """
+        shard = self.shards.of_id(ride_id)
+        with self._sole_booking(passenger, shard) as free:
+            if not free:
+                return False
+            with db.transaction(shard) as s:
+                if not s.execute('claim_seat', (ride_id,)).rowcount:
+                    return False
+                booked = self._book(s, shard, passenger, pickup, destination, vehicle, price, 'Shared', max_passengers, ride_id)
+                if booked is None:
+                    s.conn.rollback()
+                    return False
+                changes.bump(s, changes.channels_for(s.fetchone('request_channels', (ride_id,))))
+        expiry.notify(*booked, self.db_name)
+        return True
+
+    def get_pending_requests(self, vehicle_filter, near=None, radius_km=spatial.NEARBY_KM):
+        """Pending requests for a vehicle type; with ``near`` (stop or point), only pickups within ``radius_km``."""
+        if near is None:
+            rows = self.shards.gather('pending_requests', (vehicle_filter, time.time()), self.shards.candidates(vehicle_filter))
+            return sorted(rows, key=lambda r: r['id'])
+        point = self.stops.point(near)
+        cells = spatial.cells_within(*point, radius_km)
+        rows = self.shards.gather('pending_requests_near', (vehicle_filter, json.dumps(cells), time.time()),
+                                  self.shards.candidates(vehicle_filter, cells))
+        return sorted((r for r in rows if spatial.haversine_km(point, (r['pickup_lat'], r['pickup_lon'])) <= radius_km),
+                      key=lambda r: r['id'])
+
+    def driver_online(self, driver_username, vehicle, location):
+        """Announce an idle driver (at a stop name or point) to the dispatcher."""
+        lat, lon = self.stops.point(location)
+        db.execute('driver_heartbeat', (driver_username, vehicle, lat, lon, time.time()), self.db_name)
+
+    def driver_offline(self, driver_username):
+        db.execute('driver_offline', (driver_username,), self.db_name)
+
+    def get_driver_offers(self, driver_username):
+        """Pending requests the dispatcher has offered to this driver, soonest to lapse first."""
+        return sorted(self.shards.gather('driver_offers', (driver_username, time.time())), key=lambda r: r['offer_expires_at'])
+
+    def decline_offer(self, req_id, driver_username):
+        """Turn an offer down; the dispatcher will not offer this request to this driver again."""
+        with db.transaction(self.shards.of_id(req_id)) as s:
+            s.execute('decline_offer', (req_id, driver_username))
+            changes.bump(s, [changes.driver_channel(driver_username)])
+
+    def event_position(self):
+        """The newest request event seq in each shard, as a tuple for ``changes_since``."""
+        return tuple(db.fetchone('request_events_floor', db_name=shard)['latest'] or 0 for shard in self.shards.names)
+
+    def changes_since(self, position, vehicle):
+        """Request events for ``vehicle`` after ``position``: ``(latest_position, events)``.
+
+        A position holds one event ``seq`` per shard (see ``event_position``).
+        Each event row carries ``seq``, ``kind`` (created, accepted, cancelled or
+        expired) and ``request_id``, plus the request's current columns while it is
+        still in ``active_requests``. Returns None if events after ``position`` have
+        already been pruned, in which case the caller must reload from scratch.
+        """
+        latest, events = list(position), []
+        candidates = self.shards.candidates(vehicle)
+        for k, shard in enumerate(self.shards.names):
+            if shard not in candidates:
+                continue
+            with db.session(shard) as s:
+                floor = s.fetchone('request_events_floor')
+                if floor['oldest'] is not None and latest[k] + 1 < floor['oldest']:
+                    return None
+                rows = s.fetchall('request_events_since', (vehicle, latest[k]))
+            latest[k] = max(latest[k], floor['latest'] or 0, *(e['seq'] for e in rows))
+            events += rows
+        return tuple(latest), events
+
+    def get_driver_active_rides(self, driver_username):
+        return self.shards.gather('driver_active_rides', (driver_username,))
+
+    def _transition(self, req_id, name, params):
+        with db.transaction(self.shards.of_id(req_id)) as s:
+            if not s.execute(name, params).rowcount:
+                return False
+            changes.bump(s, changes.channels_for(s.fetchone('request_channels', (req_id,))))
+        return True
+
+    def accept_request(self, req_id, driver_user):
+        """Assign a still-pending, unexpired request to ``driver_user``. Returns True if this driver won it."""
+        return self._transition(req_id, 'accept_request', (driver_user, req_id, time.time()))
+
+    def complete_request(self, req_id):
+        return self._transition(req_id, 'complete_request', (req_id,))
+
+    @staticmethod
+    def _record(s, ride):
+        ride_data = {'from': ride['pickup'], 'to': ride['destination'], 'vehicle': ride['vehicle'],
+                     'price': ride['price'], 'sharing': ride['ride_type'] == 'Shared'}
+        history.record_ride(s, ride['passenger'], ride_data)
+        history.record_ride(s, ride['driver'], ride_data)
+
+    def complete_ride(self, req_id):
+        """Complete an accepted ride and record it in both riders' history, in one transaction.
+
+        Returns the completed request row, or None if it was not (or no longer) accepted.
+        When the request lives in a shard, history (in the main database) is written
+        right after the shard commits, by the one caller that won the transition.
+        """
+        shard = self.shards.of_id(req_id)
+        with db.transaction(shard) as s:
+            if not s.execute('complete_request', (req_id,)).rowcount:
+                return None
+            ride = s.fetchone('request_by_id', (req_id,))
+            if shard == self.db_name:
+                self._record(s, ride)
+            changes.bump(s, changes.channels_for(ride))
+        if shard != self.db_name:
+            with db.transaction(self.db_name) as s:
+                self._record(s, ride)
+        return ride
+
+    def get_passenger_active_request(self, passenger_user):
+        params = (passenger_user, time.time())
+        if self.shards.count == 1:
+            return db.fetchone('passenger_active_request', params, self.db_name)
+        return max(self.shards.gather('passenger_active_request', params), key=lambda r: r['id'], default=None)
+
+    def cancel_request(self, req_id):
+        """Cancel a request that no driver has accepted yet. Returns True if it was cancelled."""
+        return self._transition(req_id, 'cancel_request', (req_id,))
+
+    def find_matching_rides(self, destination, radius_km=None, pickup=None, k=matching.TOP_K):
+        """Open shared rides a passenger could join.
+
+        With ``pickup``, every open shared ride is scored by the detour needed to carry the
+        passenger, free seats and price, and the best ``k`` come back (each with ``detour_km``).
+        Otherwise: rides to the same stop, or (for a point or an explicit radius) any drop
+        within ``radius_km``.
+        """
+        if pickup is not None:
+            ranked = matching.get_matcher(self.db_name).top_k(self.stops.point(pickup), self.stops.point(destination), k)
+            return [dict(self._match(r), detour_km=detour) for r, detour in ranked]
+        if radius_km is None and isinstance(destination, str):
+            rows = self.shards.gather('matching_rides', (destination,))
+        else:
+            radius_km = radius_km or spatial.NEARBY_KM
+            point = self.stops.point(destination)
+            cells = json.dumps(spatial.cells_within(*point, radius_km))
+            rows = [r for r in self.shards.gather('matching_rides_near', (cells,))
+                    if spatial.haversine_km(point, (r['dest_lat'], r['dest_lon'])) <= radius_km]
+        return [self._match(r) for r in rows]
+
+    @staticmethod
+    def _match(r):
+        return {
+            'id': r['id'], 'from': r['pickup'], 'to': r['destination'],
+            'vehicle': r['vehicle'], 'price': r['price'],
+            'current': r['current_passengers'], 'max': r['max_passengers'],
+            'driver': r['driver']
+        }
+
+
+def open_manager(db_name=None, stops=None, backend=None):
+    """A request manager for the configured backend.
+
+    ``memory`` returns the process-wide ``MemoryRequestManager`` for the
+    database (see ``ridesync_core.memory_store``); ``sqlite`` a plain
+    ``RequestManager``. Both have the same methods and semantics.
+    """
+    if (backend or REQUEST_BACKEND) == 'memory':
+        if shards.layout(db_name).count > 1:
+            raise ValueError("the memory backend keeps every request in one store; use it with RIDESYNC_SHARDS=1")
+        from .memory_store import get_store     # it subclasses RequestManager
+        return get_store(db_name, stops)
+    return RequestManager(db_name, stops)
@@ -0,0 +1,334 @@
+"""Offline routing on a local road graph.
+
+A road network preprocessed from an OpenStreetMap extract is stored as a
+compact, array-backed adjacency list (CSR): node coordinates, per-node
+offsets into the edge arrays, edge targets and edge lengths in metres.
+Shortest paths are found with A* guided by landmarks (ALT): when the
+graph is built, ``LANDMARKS`` nodes far apart are chosen and the road
+distance from and to each is stored with the graph, and the triangle
+inequality over them bounds the distance left far more tightly than the
+straight line does. Recent answers are kept in an LRU cache, so
+repeated quotes and maps need no network at all. Points are snapped to their
+nearest node through a ``spatial.KDTree`` built over the nodes when the
+graph is loaded.
+
+    python -m ridesync_core.roadgraph build city.osm city.graph
+    python -m ridesync_core.roadgraph bench city.graph [--osrm URL] [--pairs N]
+
+The graph file is a small header followed by the raw arrays (graph, then
+landmark distances) in native byte order; rebuild it on the machine that
+serves it. Files from before landmarks still load; their landmarks are
+chosen again on every load, so rebuild those too.
+
+On a 200 x 200 grid (40k nodes, edge lengths 1-1.6x the straight line)
+the landmarks take about 2 s to choose at build time and cut a cold
+route from about 45 ms to about 7 ms (mean over 100 random pairs;
+tests/test_roadgraph.py measures it under the ``slow`` marker).
+"""
+import heapq
+import math
+import random
+import struct
+import sys
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from functools import lru_cache
+
+from .spatial import KDTree
+
+EARTH_RADIUS_M = 6371000.0
+MAGIC, MAGIC_V1 = b'RSG2', b'RSG1'
+HEADER = struct.Struct('<III')    # after the magic: node, edge and landmark counts
+HEADER_V1 = struct.Struct('<II')  # version 1 files: node and edge counts, no landmarks
+PATH_CACHE_SIZE = 4096
+LANDMARKS = 8           # ALT landmarks chosen when the graph is built
+ACTIVE_LANDMARKS = 3    # of those, the ones each query's heuristic uses
+
+# OSM highway values a car can drive on
+DRIVABLE = {
+    'motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'unclassified', 'residential',
+    'motorway_link', 'trunk_link', 'primary_link', 'secondary_link', 'tertiary_link',
+    'living_street', 'service', 'road',
+}
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class RoadGraph:
+    """Directed road graph in CSR form; node ids are ``0..len(lat)-1``."""
+    def __init__(self, lat, lon, offsets, targets, weights, landmarks=None):
+        self.lat, self.lon = lat, lon
+        self.offsets, self.targets, self.weights = offsets, targets, weights
+        self.landmarks = landmarks if landmarks is not None else self._select_landmarks(LANDMARKS)
+        # Equirectangular plane (degrees) around the graph's mean latitude; plenty for a city
+        self._lon_scale = math.cos(math.radians(sum(lat) / len(lat))) if len(lat) else 1.0
+        self._tree = KDTree([(x * self._lon_scale, y) for y, x in zip(lat, lon)])
+        self.shortest_path = lru_cache(maxsize=PATH_CACHE_SIZE)(self._astar)
+        self.nearest_node = lru_cache(maxsize=PATH_CACHE_SIZE)(self._nearest_node)
+
+    def __len__(self):
+        return len(self.lat)
+
+    @classmethod
+    def from_edges(cls, coords, edges):
+        """Build from ``[(lat, lon), ...]`` and ``[(u, v, metres), ...]`` (directed)."""
+        lat = array('d', (c[0] for c in coords))
+        lon = array('d', (c[1] for c in coords))
+        edges = sorted(edges)
+        offsets = array('q', [0] * (len(coords) + 1))
+        for u, _, _ in edges:
+            offsets[u + 1] += 1
+        for i in range(len(coords)):
+            offsets[i + 1] += offsets[i]
+        targets = array('i', (v for _, v, _ in edges))
+        weights = array('d', (w for _, _, w in edges))
+        return cls(lat, lon, offsets, targets, weights)
+
+    @classmethod
+    def from_osm(cls, path):
+        """Preprocess an OSM XML extract into a graph of its drivable ways."""
+        coords, ways = {}, []
+        for _, elem in ET.iterparse(path):
+            if elem.tag == 'node':
+                coords[elem.get('id')] = (float(elem.get('lat')), float(elem.get('lon')))
+            elif elem.tag == 'way':
+                tags = {t.get('k'): t.get('v') for t in elem.iter('tag')}
+                if tags.get('highway') in DRIVABLE:
+                    oneway = tags.get('oneway') in ('yes', '1', 'true') or tags.get('junction') == 'roundabout'
+                    ways.append(([nd.get('ref') for nd in elem.iter('nd')], oneway))
+                elem.clear()
+        index, points, edges = {}, [], []
+        for refs, oneway in ways:
+            refs = [ref for ref in refs if ref in coords]
+            for ref in refs:
+                if ref not in index:
+                    index[ref] = len(points)
+                    points.append(coords[ref])
+            for a, b in zip(refs, refs[1:]):
+                u, v = index[a], index[b]
+                metres = haversine_m(*points[u], *points[v])
+                edges.append((u, v, metres))
+                if not oneway:
+                    edges.append((v, u, metres))
+        return cls.from_edges(points, edges)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic == MAGIC:
+                n, m, k = HEADER.unpack(f.read(HEADER.size))
+            elif magic == MAGIC_V1:
+                (n, m), k = HEADER_V1.unpack(f.read(HEADER_V1.size)), None
+            else:
+                raise ValueError(f"{path} is not a RideSync road graph")
+
+            def read(typecode, count):
+                arr = array(typecode)
+                arr.fromfile(f, count)
+                return arr
+
+            arrays = [read(typecode, count) for typecode, count in (('d', n), ('d', n), ('q', n + 1), ('i', m), ('d', m))]
+            # Version 1 files carry no landmarks; they are chosen again on load
+            landmarks = None if k is None else [(node, read('d', n), read('d', n)) for node in read('i', k)]
+        return cls(*arrays, landmarks=landmarks)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(MAGIC + HEADER.pack(len(self.lat), len(self.targets), len(self.landmarks)))
+            for arr in (self.lat, self.lon, self.offsets, self.targets, self.weights):
+                arr.tofile(f)
+            array('i', (node for node, _, _ in self.landmarks)).tofile(f)
+            for _, frm, to in self.landmarks:
+                frm.tofile(f)
+                to.tofile(f)
+
+    def _nearest_node(self, lat, lon):
+        return self._tree.nearest(lon * self._lon_scale, lat)
+
+    def _reversed(self):
+        """The graph with every edge flipped, as ``(offsets, targets, weights)``."""
+        n, m = len(self.lat), len(self.targets)
+        offsets = array('q', [0]) * (n + 1)
+        for v in self.targets:
+            offsets[v + 1] += 1
+        for i in range(n):
+            offsets[i + 1] += offsets[i]
+        fill = offsets[:-1]
+        targets, weights = array('i', [0]) * m, array('d', [0.0]) * m
+        for u in range(n):
+            for i in range(self.offsets[u], self.offsets[u + 1]):
+                v = self.targets[i]
+                j = fill[v]
+                fill[v] += 1
+                targets[j], weights[j] = u, self.weights[i]
+        return offsets, targets, weights
+
+    def _dijkstra(self, source, csr=None):
+        """Metres from ``source`` to every node over ``csr`` (default: this graph); inf if unreachable."""
+        offsets, targets, weights = csr or (self.offsets, self.targets, self.weights)
+        dist = array('d', [math.inf]) * len(self.lat)
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            du, u = heapq.heappop(heap)
+            if du > dist[u]:
+                continue
+            for i in range(offsets[u], offsets[u + 1]):
+                v = targets[i]
+                nd = du + weights[i]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+
+    def _select_landmarks(self, count):
+        """Pick ``count`` landmarks far apart (farthest-point) with their distances both ways.
+
+        Returns ``[(node, metres from node, metres to node), ...]``; the
+        triangle inequality over them gives A* a far tighter bound than the
+        straight line, since roads rarely run straight.
+        """
+        if not len(self.lat):
+            return []
+        reverse = self._reversed()
+        landmarks, nearest = [], self._dijkstra(0)
+        for _ in range(count):
+            reach, node = max((d, v) for v, d in enumerate(nearest) if d < math.inf)
+            if landmarks and reach == 0:
+                break
+            frm = self._dijkstra(node)
+            landmarks.append((node, frm, self._dijkstra(node, reverse)))
+            nearest = frm if len(landmarks) == 1 else array('d', map(min, nearest, frm))
+        return landmarks
+
+    def _heuristic(self, source, target):
+        """Lower bound on metres to ``target`` for A*, or None if ``target`` is unreachable from ``source``.
+
+        Uses the ``ACTIVE_LANDMARKS`` landmarks whose bound is tightest at
+        ``source`` (for any landmark L, d(v, t) >= d(L, t) - d(L, v) and
+        d(v, t) >= d(v, L) - d(t, L)); without usable landmarks it falls back
+        to the haversine distance.
+        """
+        bounds = []
+        for _, frm, to in self.landmarks:
+            ft, tt = frm[target], to[target]
+            if ft < math.inf and tt < math.inf:
+                bounds.append((max(ft - frm[source], to[source] - tt), frm, ft, to, tt))
+        if not bounds:
+            lat, lon = self.lat, self.lon
+            tlat, tlon = lat[target], lon[target]
+            return lambda v: haversine_m(lat[v], lon[v], tlat, tlon)
+        bounds.sort(key=lambda b: b[0], reverse=True)
+        if bounds[0][0] == math.inf:
+            return None
+        active = [b[1:] for b in bounds[:ACTIVE_LANDMARKS]]
+
+        def bound(v):
+            h = 0.0
+            for frm, ft, to, tt in active:
+                b = ft - frm[v]
+                if b > h:
+                    h = b
+                b = to[v] - tt
+                if b > h:
+                    h = b
+            return h
+        return bound
+
+    def _astar(self, source, target):
+        """Return ``(metres, [node, ...])`` for the shortest path, or None."""
+        if source == target:
+            return 0.0, [source]
+        heuristic = self._heuristic(source, target)
+        if heuristic is None:
+            return None
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        dist = {source: 0.0}
+        prev = {}
+        closed = set()
+        heap = [(heuristic(source), source)]
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u == target:
+                break
+            if u in closed:
+                continue
+            closed.add(u)
+            du = dist[u]
+            for i in range(offsets[u], offsets[u + 1]):
+                v = targets[i]
+                nd = du + weights[i]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    prev[v] = u
+                    heapq.heappush(heap, (nd + heuristic(v), v))
+        else:
+            return None
+        path = [target]
+        while path[-1] != source:
+            path.append(prev[path[-1]])
+        path.reverse()
+        return dist[target], path
+
+    def route(self, src, dst):
+        """Driving distance (km) and ``[[lat, lon], ...]`` path between two points, or None."""
+        s, t = self.nearest_node(*src), self.nearest_node(*dst)
+        if s is None or t is None:
+            return None
+        found = self.shortest_path(s, t)
+        if found is None:
+            return None
+        metres, nodes = found
+        return round(metres / 1000, 2), [[self.lat[n], self.lon[n]] for n in nodes]
+
+
+_graphs = {}
+
+
+def get_graph(path):
+    """Load a graph file once per process."""
+    graph = _graphs.get(path)
+    if graph is None:
+        graph = _graphs[path] = RoadGraph.load(path)
+    return graph
+
+
+def bench(graph, pairs=200, osrm_url=None, http_pairs=10, seed=0):
+    """Compare local A* latency with the OSRM HTTP path; returns ms per route."""
+    from .routing import fetch_route
+
+    rng = random.Random(seed)
+    points = [(graph.lat[i], graph.lon[i]) for i in (rng.randrange(len(graph)) for _ in range(2 * pairs))]
+    pairs = list(zip(points[::2], points[1::2]))
+
+    def per_route_ms(fn, sample):
+        start = time.perf_counter()
+        for src, dst in sample:
+            fn(src, dst)
+        return (time.perf_counter() - start) * 1000 / len(sample)
+
+    results = {'local_cold_ms': per_route_ms(graph.route, pairs),
+               'local_warm_ms': per_route_ms(graph.route, pairs)}
+    results['osrm_ms'] = per_route_ms(lambda a, b: fetch_route(a, b, osrm_url), pairs[:http_pairs])
+    return results
+
+
+if __name__ == '__main__':
+    command, args = sys.argv[1], sys.argv[2:]
+    if command == 'build':
+        g = RoadGraph.from_osm(args[0])
+        g.save(args[1])
+        print(f"{len(g)} nodes, {len(g.targets)} edges, {len(g.landmarks)} landmarks -> {args[1]}")
+    elif command == 'bench':
+        opts = dict(zip(args[1::2], args[2::2]))
+        stats = bench(RoadGraph.load(args[0]), int(opts.get('--pairs', 200)), opts.get('--osrm'))
+        for name, ms in stats.items():
+            print(f"{name:>14}: {ms:8.3f} ms/route")
+    else:
+        sys.exit(f"unknown command {command!r}; expected build or bench")
@@ -0,0 +1,154 @@
+"""Driving routes: pluggable backends plus a persistent, prefetched cache.
+
+``ROUTING_BACKENDS`` (env ``RIDESYNC_ROUTING_BACKENDS``, comma separated) lists
+the backends to try in order:
+
+* ``osrm``  -- an OSRM server, through the route cache described below;
+* ``local`` -- A* on the road graph file at ``RIDESYNC_ROAD_GRAPH``
+  (see ``ridesync_core.roadgraph``), no network at all.
+
+Whatever is configured, a straight-line estimate is the last resort.
+
+OSRM routes come from an OSRM server (``RIDESYNC_OSRM_URL``, the public demo
+server by default) and are stored in the ``route_cache`` table as distance
+plus encoded polyline, so they survive restarts and are shared by every
+worker process. Entries expire after ``ROUTE_TTL`` and are ignored when
+``ROUTE_CACHE_VERSION`` changes. Network calls use strict timeouts; if the
+server is slow or down the caller gets a straight-line (haversine) estimate
+instead of a hung rerun. ``requests`` is imported on the first fetch, so
+cache hits and the other backends never load it.
+
+Points are ``(lat, lon)`` tuples throughout; paths are lists of ``[lat, lon]``.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import permutations
+
+import polyline
+
+from . import db, metrics, roadgraph
+from .spatial import haversine_km
+
+ROUTING_BACKENDS = os.environ.get('RIDESYNC_ROUTING_BACKENDS', 'osrm').split(',')
+OSRM_URL = os.environ.get('RIDESYNC_OSRM_URL', 'http://router.project-osrm.org')
+ROAD_GRAPH = os.environ.get('RIDESYNC_ROAD_GRAPH', 'roads.graph')
+ROUTE_TIMEOUT = (2, 3)           # (connect, read) seconds
+ROUTE_TTL = 7 * 24 * 3600        # seconds a cached route stays valid
+ROUTE_CACHE_VERSION = 1          # bump to invalidate every cached route
+WARM_WORKERS = 8
+WARM_MAX_POINTS = 40             # n*(n-1) pairs; larger catalogues are fetched on demand
+ROAD_FACTOR = 1.2                # straight line -> rough road distance
+
+_warmed = set()
+_warm_lock = threading.Lock()
+
+
+def point_key(point):
+    lat, lon = point
+    return f'{lat:.5f},{lon:.5f}'
+
+
+def straight_line_route(src, dst):
+    return round(haversine_km(src, dst) * ROAD_FACTOR, 2), [list(src), list(dst)]
+
+
+def fetch_route(src, dst, base_url=None, timeout=None):
+    """Ask OSRM for a route; returns ``(distance_km, encoded_polyline)`` or None."""
+    (src_lat, src_lon), (dst_lat, dst_lon) = src, dst
+    import requests
+    url = f"{base_url or OSRM_URL}/route/v1/driving/{src_lon},{src_lat};{dst_lon},{dst_lat}?overview=full"
+    try:
+        with metrics.timer('ridesync_route_fetch_seconds', backend='osrm'):
+            data = requests.get(url, timeout=timeout or ROUTE_TIMEOUT).json()
+        if data['code'] == 'Ok':
+            route = data['routes'][0]
+            return round(route['distance'] / 1000, 2), route['geometry']
+    except (requests.RequestException, ValueError, KeyError, IndexError):
+        pass
+    return None
+
+
+def cached_route(src, dst, db_name=None):
+    """Return ``(distance_km, encoded_polyline)`` from the cache, or None."""
+    row = db.fetchone('route_cache_get', (point_key(src), point_key(dst), ROUTE_CACHE_VERSION, time.time() - ROUTE_TTL), db_name)
+    return (row['distance_km'], row['geometry']) if row else None
+
+
+def store_route(src, dst, distance_km, geometry, db_name=None):
+    db.execute('route_cache_put', (point_key(src), point_key(dst), ROUTE_CACHE_VERSION, distance_km, geometry, time.time()), db_name)
+
+
+def osrm_route(src, dst, base_url=None, db_name=None):
+    """OSRM route through the persistent cache, or None if the server fails."""
+    hit = cached_route(src, dst, db_name)
+    metrics.count('ridesync_cache_requests_total', cache='route')
+    if hit is None:
+        metrics.count('ridesync_cache_misses_total', cache='route')
+        hit = fetch_route(src, dst, base_url)
+        if hit is None:
+            return None
+        store_route(src, dst, *hit, db_name=db_name)
+    distance_km, geometry = hit
+    return distance_km, polyline.decode(geometry)
+
+
+def local_route(src, dst, graph_path=None, **_):
+    """Route on the local road graph, or None if there is no graph or no path."""
+    graph_path = graph_path or ROAD_GRAPH
+    if not os.path.exists(graph_path):
+        return None
+    return roadgraph.get_graph(graph_path).route(src, dst)
+
+
+BACKENDS = {'osrm': osrm_route, 'local': local_route}
+
+
+def get_route(src, dst, base_url=None, db_name=None, backends=None):
+    """Driving distance (km) and path between two points from the first backend that answers."""
+    if src == dst:
+        return 0, []
+    for name in backends or ROUTING_BACKENDS:
+        with metrics.timer('ridesync_route_seconds', backend=name):
+            route = BACKENDS[name](src, dst, base_url=base_url, db_name=db_name)
+        if route is not None:
+            return route
+    return straight_line_route(src, dst)
+
+
+def warm_cache(points, base_url=None, db_name=None, workers=WARM_WORKERS):
+    """Fetch every missing or stale route between ``points`` concurrently.
+
+    Returns the number of routes fetched from the server.
+    """
+    missing = [(a, b) for a, b in permutations(points, 2) if cached_route(a, b, db_name) is None]
+    if not missing:
+        return 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda pair: fetch_route(*pair, base_url=base_url), missing))
+    fetched = 0
+    for (src, dst), hit in zip(missing, results):
+        if hit is not None:
+            store_route(src, dst, *hit, db_name=db_name)
+            fetched += 1
+    return fetched
+
+
+def warm_cache_async(points, base_url=None, db_name=None):
+    """Start ``warm_cache`` in a background thread, once per process and database.
+
+    Returns the thread, or None if nothing was started.
+    """
+    points = list(points)
+    if 'osrm' not in ROUTING_BACKENDS or len(points) > WARM_MAX_POINTS:
+        return None
+    key = db_name or db.DB_NAME
+    with _warm_lock:
+        if key in _warmed:
+            return None
+        _warmed.add(key)
+    thread = threading.Thread(target=warm_cache, args=(points, base_url, db_name),
+                              name='ridesync-route-warm', daemon=True)
+    thread.start()
+    return thread
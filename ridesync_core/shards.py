@@ -0,0 +1,128 @@
+"""Request storage split across several SQLite files.
+
+With ``RIDESYNC_SHARDS=N`` (N > 1) the request tables -- ``active_requests``
+and everything written in the same transactions: ``archived_requests``, the
+request event log, dispatcher offers and the change counters -- live in N
+files beside the main database (``ridesync.shard0.db`` ...), each migrated
+to the full schema. Users, ride history, driver presence and the route cache
+stay in the main file. A booking or transition takes only its own shard's
+write lock, so writes to different shards commit in parallel instead of
+queueing on one file.
+
+``RIDESYNC_SHARD_KEY`` decides where a new request goes: ``vehicle`` (the
+default; a driver's pending list and event feed then live in one file) or
+``zone`` (its pickup grid cell). A seat on a shared ride is always booked in
+the ride's shard, so joining stays one transaction. Request ids encode their
+shard -- ``(id - 1) % N`` -- so accept, cancel and complete go straight to
+the right file. Reads that span shards (a passenger's open request, a
+driver's rides and offers, change counters, shared rides) scatter-gather.
+With the default N = 1 the only shard is the main database itself and
+nothing changes.
+
+The ``vehicle`` key puts each vehicle type in one shard, so it spreads
+writes over at most ``len(fares.VEHICLES)`` files; ``zone`` spreads them as
+far as pickups do. One passenger never has open requests in two shards
+booked through the same process; two processes booking the same passenger
+on different shards at the same instant are not serialized. Requests left
+in the main file when sharding is switched on are not moved: drain them (or
+let them expire) first. The in-memory backend keeps a single store and
+needs ``RIDESYNC_SHARDS=1``.
+
+Request counts per shard, read from every shard's ``all_requests`` view::
+
+    python -m ridesync_core.shards [db]
+"""
+import os
+import sys
+import threading
+import zlib
+
+from . import db
+from .fares import VEHICLES
+
+SHARD_COUNT = int(os.environ.get('RIDESYNC_SHARDS', '1'))
+SHARD_KEY = os.environ.get('RIDESYNC_SHARD_KEY', 'vehicle')   # 'vehicle' or 'zone'
+PASSENGER_LOCKS = 64
+
+
+class ShardLayout:
+    """Where the request tables of one main database live."""
+    def __init__(self, db_name, count=SHARD_COUNT, key=SHARD_KEY):
+        self.db_name = db_name
+        self.count = count
+        self.key = key
+        if count == 1:
+            self.names = [db_name]
+        else:
+            stem, ext = os.path.splitext(db_name)
+            self.names = [f'{stem}.shard{k}{ext}' for k in range(count)]
+        self._locks = [threading.Lock() for _ in range(PASSENGER_LOCKS)]
+
+    def of_id(self, req_id):
+        """The shard holding request ``req_id``."""
+        return self.names[(req_id - 1) % self.count]
+
+    def index(self, shard):
+        return self.names.index(shard)
+
+    def _hash(self, vehicle, cell):
+        if self.key == 'zone':
+            return zlib.crc32(str(cell).encode())
+        return VEHICLES.index(vehicle) if vehicle in VEHICLES else zlib.crc32(str(vehicle).encode())
+
+    def route(self, vehicle, cell):
+        """The shard a new request for ``vehicle`` picked up in grid ``cell`` is booked in."""
+        return self.names[self._hash(vehicle, cell) % self.count]
+
+    def candidates(self, vehicle, cells=None):
+        """Shards that can hold requests for ``vehicle`` (picked up in ``cells``, if given)."""
+        if self.count == 1 or (self.key == 'zone' and cells is None):
+            return self.names
+        if self.key == 'zone':
+            wanted = {self.route(vehicle, c) for c in cells}
+            return [name for name in self.names if name in wanted]
+        return [self.route(vehicle, None)]
+
+    def id_params(self, shard):
+        """Parameters for ``book_request``'s id: the next id in ``shard`` is its max id plus ``count``."""
+        return self.index(shard) + 1 - self.count, self.count
+
+    def passenger_lock(self, passenger):
+        """Serializes one passenger's bookings across shards, within this process."""
+        return self._locks[zlib.crc32(passenger.encode()) % PASSENGER_LOCKS]
+
+    def gather(self, name, params=(), shards=None):
+        """Rows of statement ``name`` from every shard (or just ``shards``), shard by shard."""
+        return [row for shard in (shards or self.names) for row in db.fetchall(name, params, shard)]
+
+
+_layouts = {}
+_layouts_lock = threading.Lock()
+
+
+def layout(db_name=None):
+    """The shard layout of a main database, from ``RIDESYNC_SHARDS``/``RIDESYNC_SHARD_KEY`` unless configured."""
+    key = db_name or db.DB_NAME
+    found = _layouts.get(key)
+    if found is None:
+        with _layouts_lock:
+            found = _layouts.setdefault(key, ShardLayout(key))
+    return found
+
+
+def configure(db_name=None, count=SHARD_COUNT, key=SHARD_KEY):
+    """Fix the layout of a database for this process (before anything has used it)."""
+    with _layouts_lock:
+        found = _layouts[db_name or db.DB_NAME] = ShardLayout(db_name or db.DB_NAME, count, key)
+    return found
+
+
+def summary(db_name=None):
+    """``{shard: {status: requests}}`` over live and archived requests in every shard."""
+    return {shard: {row['status']: row['requests'] for row in db.fetchall('request_status_counts', db_name=shard)}
+            for shard in layout(db_name).names}
+
+
+if __name__ == '__main__':
+    for shard, counts in summary(sys.argv[1] if len(sys.argv) > 1 else None).items():
+        print(f"{shard}: " + ', '.join(f"{status} {n}" for status, n in sorted(counts.items())))
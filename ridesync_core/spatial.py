@@ -0,0 +1,177 @@
+"""Stops, coordinate snapping and spatial lookups.
+
+A ``StopCatalogue`` maps stop names to ``(lat, lon)`` and keeps them in a
+2-d tree, so snapping an arbitrary coordinate to its nearest stop and listing
+the stops within a radius take O(log n) instead of a pass over every name.
+Catalogues are bulk-loaded from a ``name,lat,lon`` CSV file (``RIDESYNC_STOPS``)
+and fall back to the built-in ``DEFAULT_STOPS``.
+
+Requests in the database carry a coarse grid cell (``cell()``) for their
+pickup and destination, so "requests near here" becomes an indexed
+``cell IN (...)`` lookup over ``cells_within()`` followed by an exact
+distance check on the few rows that come back.
+"""
+import csv
+import math
+import os
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON = 111.320      # at the equator; scaled by cos(latitude)
+CELL_DEG = 0.009              # grid cell edge, roughly 1 km
+NEARBY_KM = 2.0               # default radius for "near" queries
+STOPS_FILE = os.environ.get('RIDESYNC_STOPS', 'stops.csv')
+
+DEFAULT_STOPS = {
+    "LJU Campus": (22.9912, 72.4884),
+    "Prahlad Nagar": (23.0120, 72.5108),
+    "Anand Nagar": (23.0180, 72.5200),
+    "Satellite": (23.0300, 72.5170),
+    "Vastrapur": (23.0387, 72.5307),
+    "Bodakdev": (23.0380, 72.5100),
+    "Ambawadi": (23.0230, 72.5560),
+    "Navrangpura": (23.0365, 72.5610)
+}
+
+
+def haversine_km(src, dst):
+    lat1, lon1, lat2, lon2 = map(math.radians, (*src, *dst))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def cell(lat, lon):
+    """Integer id of the ~1 km grid cell containing a point."""
+    return (math.floor(lat / CELL_DEG) + 10000) * 100000 + (math.floor(lon / CELL_DEG) + 20000)
+
+
+def cells_within(lat, lon, radius_km):
+    """Ids of every grid cell overlapping the box around a circle of ``radius_km``."""
+    dlat = radius_km / KM_PER_DEG_LAT
+    dlon = radius_km / (KM_PER_DEG_LON * max(math.cos(math.radians(lat)), 1e-6))
+    y0, y1 = math.floor((lat - dlat) / CELL_DEG), math.floor((lat + dlat) / CELL_DEG)
+    x0, x1 = math.floor((lon - dlon) / CELL_DEG), math.floor((lon + dlon) / CELL_DEG)
+    return [(y + 10000) * 100000 + (x + 20000) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+
+class KDTree:
+    """Static 2-d tree over planar ``(x, y)`` points."""
+    def __init__(self, points):
+        self.points = points
+        self.root = self._build(list(range(len(points))), 0)
+
+    def _build(self, idx, axis):
+        if not idx:
+            return None
+        idx.sort(key=lambda i: self.points[i][axis])
+        mid = len(idx) // 2
+        return (idx[mid], axis, self._build(idx[:mid], 1 - axis), self._build(idx[mid + 1:], 1 - axis))
+
+    def nearest(self, x, y):
+        """Index of the point closest to ``(x, y)``, or None if the tree is empty."""
+        best = [None, math.inf]
+
+        def visit(node):
+            if node is None:
+                return
+            i, axis, left, right = node
+            px, py = self.points[i]
+            d = (px - x) ** 2 + (py - y) ** 2
+            if d < best[1]:
+                best[0], best[1] = i, d
+            delta = (x, y)[axis] - (px, py)[axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            visit(near)
+            if delta * delta < best[1]:
+                visit(far)
+
+        visit(self.root)
+        return best[0]
+
+    def within(self, x, y, radius):
+        """Indices of every point within ``radius`` of ``(x, y)``."""
+        found, r2 = [], radius * radius
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            i, axis, left, right = node
+            px, py = self.points[i]
+            if (px - x) ** 2 + (py - y) ** 2 <= r2:
+                found.append(i)
+            delta = (x, y)[axis] - (px, py)[axis]
+            stack.append(left if delta < 0 else right)
+            if delta * delta <= r2:
+                stack.append(right if delta < 0 else left)
+        return found
+
+
+class StopCatalogue:
+    """Named pickup/drop points with nearest-stop and radius queries.
+
+    Coordinates are projected onto a local plane (km) around the catalogue's
+    centre, which is accurate to well under 1% across a city.
+    """
+    def __init__(self, stops):
+        self.stops = dict(stops)
+        self.names = list(self.stops)
+        coords = list(self.stops.values())
+        self.lat0 = sum(c[0] for c in coords) / len(coords) if coords else 0.0
+        self._lon_scale = KM_PER_DEG_LON * math.cos(math.radians(self.lat0))
+        self.tree = KDTree([self._project(lat, lon) for lat, lon in coords])
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.stops
+
+    @classmethod
+    def from_csv(cls, path):
+        """Bulk-load a ``name,lat,lon`` file (a header row is skipped if present)."""
+        stops = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if len(row) < 3 or row[0].strip().lower() == 'name':
+                    continue
+                stops[row[0].strip()] = (float(row[1]), float(row[2]))
+        return cls(stops)
+
+    def _project(self, lat, lon):
+        return (lon * self._lon_scale, (lat - self.lat0) * KM_PER_DEG_LAT)
+
+    def point(self, place):
+        """``(lat, lon)`` of a stop name, or the coordinates themselves."""
+        return self.stops[place] if isinstance(place, str) else tuple(place)
+
+    def name(self, place):
+        """Stop name for a name or a coordinate (snapped to the nearest stop)."""
+        return place if isinstance(place, str) else self.snap(*place)
+
+    def snap(self, lat, lon):
+        """Name of the stop nearest to a coordinate."""
+        i = self.tree.nearest(*self._project(lat, lon))
+        return None if i is None else self.names[i]
+
+    def near(self, lat, lon, radius_km):
+        """``[(name, km), ...]`` of stops within ``radius_km``, nearest first."""
+        hits = ((self.names[i], haversine_km((lat, lon), self.stops[self.names[i]]))
+                for i in self.tree.within(*self._project(lat, lon), radius_km))
+        return sorted(hits, key=lambda hit: hit[1])
+
+
+_catalogues = {}
+
+
+def load_catalogue(path=None):
+    """Catalogue from ``path`` (or ``RIDESYNC_STOPS``) if it exists, else ``DEFAULT_STOPS``.
+
+    Built once per process and path.
+    """
+    path = path or STOPS_FILE
+    catalogue = _catalogues.get(path)
+    if catalogue is None:
+        catalogue = StopCatalogue.from_csv(path) if os.path.exists(path) else StopCatalogue(DEFAULT_STOPS)
+        _catalogues[path] = catalogue
+    return catalogue
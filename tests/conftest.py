@@ -0,0 +1,37 @@
+"""Shared fixtures: throwaway databases, migrated and (optionally) sharded."""
+import os
+import sqlite3
+
+import pytest
+
+from ridesync_core import db, migrations, shards
+
+
+
+@pytest.fixture
+def tracked_db():
+    """The demo database checked into the repository (only ever copied, never opened in place)."""
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ridesync.db')
+
+
+@pytest.fixture
+def make_db(tmp_path):
+    """Factory for migrated databases under ``tmp_path``; their pools are closed afterwards.
+
+    ``source`` starts the copy from an existing database instead of an empty one.
+    """
+    made = set()
+
+    def make(name='ridesync.db', count=1, key=shards.SHARD_KEY, source=None):
+        path = str(tmp_path / name)
+        if source:
+            with sqlite3.connect(source) as src, sqlite3.connect(path) as dst:
+                src.backup(dst)
+        layout = shards.configure(path, count, key)
+        migrations.migrate(path)
+        made.update({path, *layout.names})
+        return path
+
+    yield make
+    for name in made:
+        db.get_pool(name).close()
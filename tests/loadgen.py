@@ -0,0 +1,238 @@
+"""Synthetic load on the booking lifecycle, reported as JSON.
+
+Runs against a throwaway database for ``--seconds``. ``--passengers``
+simulated passengers book solo or shared rides, join open shared rides,
+cancel, read their history, or leave a request to its fate. ``--drivers``
+simulated drivers pick pending requests for their vehicle, accept them and
+complete the ride ``--ride`` seconds later; everyone pauses ``--think``
+seconds between actions. An expiry worker runs alongside in every process,
+as it would in every app process, so requests nobody accepts expire after
+``RIDESYNC_REQUEST_TTL`` seconds (set it low for short runs). Every decision is drawn with the
+probabilities in ``RATES``, each overridable by a flag of the same name
+(``--cancel 0.2``).
+
+Users run as threads, split over ``--processes`` worker processes. Every
+call into ``RequestManager`` and ``RideHistoryManager`` is timed. The report
+gives per-operation counts, refusals (a lost accept, a full ride), throughput
+and p50/p95/p99 latency in milliseconds. It also gives write-lock waits
+(``db.lock_stats``) and the request and event counts the run left behind::
+
+    python -m tests.loadgen [--passengers N] [--drivers M] [--seconds S] [--processes P] [--think S] [--ride S]
+        [--backend sqlite|memory] [--shards S] [--key vehicle|zone] [--seed X] [--out report.json] [--<rate> p ...]
+
+Compare the JSON of two releases to catch regressions; ``test_loadgen.py``
+runs short simulations of it under the ``slow`` marker.
+"""
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from ridesync_core import db, expiry, migrations, shards
+from ridesync_core.fares import VEHICLES
+from ridesync_core.history import RideHistoryManager
+from ridesync_core.request_manager import REQUEST_TTL, open_manager
+
+RATES = {
+    'share': 0.3,      # a booking is a shared ride
+    'join': 0.3,       # a passenger without a request first looks for a shared ride to join
+    'cancel': 0.05,    # per poll, a passenger cancels their pending request
+    'history': 0.1,    # per poll, an idle passenger opens their history
+    'accept': 0.5,     # per poll, an idle driver takes one of the pending requests
+}
+THINK_SECONDS = 0.05   # pause between a simulated user's actions
+RIDE_SECONDS = 0.5     # an accepted ride is completed this long after the accept
+PERCENTILES = (50, 95, 99)
+
+
+class Recorder:
+    """Latency samples and refusals per operation, for one worker process."""
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.refused = Counter()
+        self._lock = threading.Lock()
+
+    def call(self, op, fn, *args, write=False):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples[op].append(elapsed)
+            if write and not result:
+                self.refused[op] += 1
+        return result
+
+
+class Simulation:
+    """The passengers and drivers of one worker process."""
+    def __init__(self, db_name, passengers, drivers, rates, seed, backend=None, think=THINK_SECONDS, ride=RIDE_SECONDS):
+        self.manager = open_manager(db_name, backend=backend)
+        self.history = RideHistoryManager(db_name)
+        self.stops = list(self.manager.stops.stops)
+        self.passengers = passengers
+        self.drivers = drivers
+        self.rates = rates
+        self.seed = seed
+        self.think = think
+        self.ride = ride
+        self.recorder = Recorder()
+
+    def passenger(self, name, rng, deadline):
+        m, rec = self.manager, self.recorder
+        while time.time() < deadline:
+            req = rec.call('poll_booking', m.get_passenger_active_request, name)
+            if req is None:
+                if rng.random() < self.rates['history']:
+                    rec.call('history_page', self.history.get_history_page, name)
+                    rec.call('history_stats', self.history.get_user_stats, name)
+                pickup, destination = rng.sample(self.stops, 2)
+                vehicle = rng.choice(VEHICLES)
+                joined = False
+                if rng.random() < self.rates['join']:
+                    matches = rec.call('match', lambda: m.find_matching_rides(destination, pickup=pickup))
+                    if matches:
+                        ride = matches[0]
+                        joined = rec.call('join', m.join_request, ride['id'], name, pickup, destination,
+                                          ride['vehicle'], ride['price'], write=True)
+                if not joined:
+                    shared = rng.random() < self.rates['share']
+                    seats = 3 if vehicle == 'auto' else 4 if vehicle == 'car' else 1
+                    rec.call('book', m.book_request, name, pickup, destination, vehicle, 100,
+                             'Shared' if shared else 'Solo', seats, write=True)
+            elif req['status'] == 'pending' and rng.random() < self.rates['cancel']:
+                rec.call('cancel', m.cancel_request, req['id'], write=True)
+            time.sleep(self.think)
+
+    def driver(self, name, rng, deadline):
+        m, rec = self.manager, self.recorder
+        vehicle = rng.choice(VEHICLES)
+        accepted_at = {}
+        while time.time() < deadline:
+            rides = rec.call('poll_rides', m.get_driver_active_rides, name)
+            if rides:
+                for ride in rides:
+                    if time.time() - accepted_at.setdefault(ride['id'], time.time()) >= self.ride:
+                        rec.call('complete', m.complete_ride, ride['id'], write=True)
+            else:
+                pending = rec.call('pending', m.get_pending_requests, vehicle)
+                if pending and rng.random() < self.rates['accept']:
+                    req = rng.choice(pending)
+                    if rec.call('accept', m.accept_request, req['id'], name, write=True):
+                        accepted_at[req['id']] = time.time()
+            time.sleep(self.think)
+
+    def run(self, seconds):
+        """Run every user for ``seconds``; returns the raw samples, refusals and lock waits."""
+        db.lock_stats(reset=True)
+        deadline = time.time() + seconds
+        threads = [threading.Thread(target=self.passenger, args=(name, random.Random(f'{self.seed}:{name}'), deadline))
+                   for name in self.passengers]
+        threads += [threading.Thread(target=self.driver, args=(name, random.Random(f'{self.seed}:{name}'), deadline))
+                    for name in self.drivers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if hasattr(self.manager, 'close'):
+            self.manager.close()
+        return {'samples': dict(self.recorder.samples), 'refused': dict(self.recorder.refused), 'locks': db.lock_stats()}
+
+
+def _worker(config, passengers, drivers, seed, out):
+    shards.configure(config['db_name'], config['shards'], config['key'])
+    # Bookings are only scheduled with their own process's worker; others would see them at the next resync
+    worker = expiry.start(config['db_name'])
+    sim = Simulation(config['db_name'], passengers, drivers, config['rates'], seed, config['backend'], config['think'], config['ride'])
+    result = sim.run(config['seconds'])
+    worker.stop()
+    out.put(result)
+
+
+def summarize(results, elapsed):
+    """Fold the workers' raw results into the report's per-operation table and lock totals."""
+    samples, refused, locks = defaultdict(list), Counter(), Counter()
+    for result in results:
+        for op, values in result['samples'].items():
+            samples[op] += values
+        refused.update(result['refused'])
+        locks.update(result['locks'])
+    operations = {}
+    for op in sorted(samples):
+        ms = np.asarray(samples[op]) * 1000
+        operations[op] = {
+            'count': len(ms), 'refused': refused[op], 'per_s': round(len(ms) / elapsed, 1),
+            **{f'p{p}_ms': round(float(v), 3) for p, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES))},
+            'max_ms': round(float(ms.max()), 3),
+        }
+    return operations, {'waits': locks['waits'], 'wait_seconds': round(locks['wait_seconds'], 3), 'timeouts': locks['timeouts']}
+
+
+def run(passengers=50, drivers=20, seconds=10, processes=1, rates=None, seed=0, db_name=None, backend=None,
+        think=THINK_SECONDS, ride=RIDE_SECONDS):
+    """Run the simulation against ``db_name`` (migrated, shards configured) and return the report dict."""
+    rates = {**RATES, **(rates or {})}
+    if backend == 'memory' and processes > 1:
+        raise ValueError("the memory backend hands out request ids in one process; use --processes 1")
+    layout = shards.layout(db_name)
+    config = {'db_name': db_name, 'seconds': seconds, 'rates': rates, 'backend': backend, 'think': think, 'ride': ride,
+              'shards': layout.count, 'key': layout.key}
+    names = [f'load_p{i}' for i in range(passengers)], [f'load_d{i}' for i in range(drivers)]
+    worker = expiry.start(db_name)
+    start = time.perf_counter()
+    if processes == 1:
+        results = [Simulation(db_name, *names, rates, seed, backend, think, ride).run(seconds)]
+    else:
+        # Fresh interpreters: pooled connections must not cross a fork
+        ctx = multiprocessing.get_context('spawn')
+        out = ctx.Queue()
+        procs = [ctx.Process(target=_worker, args=(config, names[0][k::processes], names[1][k::processes], seed, out))
+                 for k in range(processes)]
+        for p in procs:
+            p.start()
+        results = [out.get() for _ in procs]
+        for p in procs:
+            p.join()
+    elapsed = time.perf_counter() - start
+    worker.stop()
+    operations, locks = summarize(results, elapsed)
+    statuses, events = Counter(), Counter()
+    for row in layout.gather('request_status_counts'):
+        statuses[row['status']] += row['requests']
+    for row in layout.gather('request_event_counts'):
+        events[row['kind']] += row['events']
+    return {
+        'config': {'passengers': passengers, 'drivers': drivers, 'seconds': seconds, 'processes': processes,
+                   'backend': backend or 'sqlite', 'shards': layout.count, 'key': layout.key, 'seed': seed,
+                   'think_s': think, 'ride_s': ride, 'rates': rates, 'request_ttl': REQUEST_TTL},
+        'elapsed_s': round(elapsed, 3),
+        'operations': operations,
+        'lock_waits': locks,
+        'requests': dict(statuses),
+        'events': dict(events),
+    }
+
+
+if __name__ == '__main__':
+    opts = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'loadgen.db')
+        layout = shards.configure(path, int(opts.get('--shards', shards.SHARD_COUNT)), opts.get('--key', shards.SHARD_KEY))
+        migrations.migrate(path)
+        report = run(int(opts.get('--passengers', 50)), int(opts.get('--drivers', 20)), float(opts.get('--seconds', 10)),
+                     int(opts.get('--processes', 1)), {k: float(opts[f'--{k}']) for k in RATES if f'--{k}' in opts},
+                     int(opts.get('--seed', 0)), path, opts.get('--backend'),
+                     float(opts.get('--think', THINK_SECONDS)), float(opts.get('--ride', RIDE_SECONDS)))
+        for name in {path, *layout.names}:
+            db.get_pool(name).close()
+    text = json.dumps(report, indent=2)
+    if '--out' in opts:
+        with open(opts['--out'], 'w') as f:
+            f.write(text + '\n')
+    print(text)
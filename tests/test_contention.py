@@ -0,0 +1,98 @@
+"""Races on request state transitions.
+
+``drivers`` threads book ``requests`` pending requests (spread over vehicle
+types and pickups) between them and then race to accept every one of them,
+then ``passengers`` threads race to join a single shared ride. No booking
+may go missing, no request may be won by more than one driver and the ride
+must end up with exactly as many riders as seats.
+
+Every backend of ``request_manager.open_manager`` must pass. Once the races
+are over, the winners are read back through a plain SQLite manager as well,
+so a write-behind backend is also checked for what it persisted. The
+``slow`` benchmark prints ``books_per_s`` and ``accepts_per_s``, which show
+how write throughput changes with the shard count.
+"""
+import threading
+import time
+
+import pytest
+
+from ridesync_core.fares import VEHICLES
+from ridesync_core.request_manager import RequestManager, open_manager
+
+PICKUPS = ('Satellite', 'Bodakdev', 'Navrangpura', 'Ambawadi', 'LJU Campus', 'Prahlad Nagar')
+# (backend, shard count); the memory backend keeps every request in one store
+SETUPS = [('sqlite', 1), ('sqlite', 3), ('memory', 1)]
+
+
+def _race(workers, target):
+    """Run ``target(i)`` in ``workers`` threads released together; returns (results, seconds)."""
+    gate = threading.Barrier(workers)
+    results = [None] * workers
+
+    def run(i):
+        gate.wait()
+        results[i] = target(i)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(workers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - start
+
+
+def race(db_name, backend=None, requests=200, drivers=8, passengers=16):
+    """Run both races and return a dict of counts and throughput."""
+    manager = open_manager(db_name, backend=backend)
+    booked, book_s = _race(drivers, lambda d: sum(
+        manager.book_request(f'bench_p{i}', PICKUPS[i % len(PICKUPS)], 'Vastrapur', VEHICLES[i % len(VEHICLES)], 100, 'Solo', 4)
+        for i in range(d, requests, drivers)))
+    ids = sorted(r['id'] for vehicle in VEHICLES for r in manager.get_pending_requests(vehicle))
+
+    def accept_all(d):
+        return [req_id for req_id in ids if manager.accept_request(req_id, f'bench_d{d}')]
+
+    won, accept_s = _race(drivers, accept_all)
+    winners = [req_id for per_driver in won for req_id in per_driver]
+
+    manager.book_request('bench_host', 'Satellite', 'Vastrapur', 'auto', 60, 'Shared', 3)
+    host = manager.get_passenger_active_request('bench_host')
+    joined, join_s = _race(passengers, lambda p: manager.join_request(
+        host['id'], f'bench_j{p}', 'Satellite', 'Vastrapur', 'auto', 60))
+    seats = manager.get_passenger_active_request('bench_host')['current_passengers']
+
+    if hasattr(manager, 'close'):
+        manager.close()
+    on_disk = RequestManager(db_name)
+    persisted = sum(len(on_disk.get_driver_active_rides(f'bench_d{d}')) for d in range(drivers))
+    persisted_riders = on_disk.get_passenger_active_request('bench_host')['current_passengers']
+
+    return {
+        'booked': sum(booked), 'books_per_s': requests / book_s,
+        'requests': len(ids), 'accepted': len(winners), 'distinct_accepted': len(set(winners)),
+        'accepts_per_s': drivers * len(ids) / accept_s,
+        'persisted': persisted,
+        'seats': host['max_passengers'], 'riders': seats, 'persisted_riders': persisted_riders, 'joined': sum(joined),
+        'joins_per_s': passengers / join_s,
+    }
+
+
+def check(stats):
+    assert stats['booked'] == stats['requests'] == stats['persisted']
+    assert stats['accepted'] == stats['distinct_accepted'] == stats['requests']
+    assert stats['riders'] == stats['persisted_riders'] == stats['seats'] == stats['joined'] + 1
+
+
+@pytest.mark.parametrize('backend, count', SETUPS)
+def test_races(make_db, backend, count):
+    check(race(make_db(count=count), backend, requests=60, drivers=4, passengers=8))
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('backend, count', SETUPS)
+def test_race_throughput(make_db, backend, count):
+    stats = race(make_db(count=count), backend)
+    check(stats)
+    print(f"{backend} x{count}: " + ', '.join(f"{k} {v:.0f}" for k, v in stats.items() if k.endswith('_per_s')))
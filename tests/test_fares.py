@@ -0,0 +1,48 @@
+"""Bulk fare quotes must match the scalar tariff exactly, fare for fare."""
+import numpy as np
+import pytest
+
+from ridesync_core.fares import SHARING, VEHICLES, FareTable, calculate_price, price, quote
+
+SURGES = (1.0, 1.3, 2.0)
+EDGES = [0, 0.0, 0.5, 1, 2.5]
+
+
+def samples(n, seed=0):
+    """Edge cases plus ``n`` rounded and ``n`` unrounded distances up to 60 km."""
+    rng = np.random.default_rng(seed)
+    return [*EDGES, *np.round(rng.uniform(0, 60, n), 2).tolist(), *rng.uniform(0, 60, n).tolist()]
+
+
+def mismatches(distances, tariffs=None, surge=1.0):
+    """``(distance, vehicle, sharing)`` cases where ``quote`` differs from ``calculate_price``."""
+    fares = quote(distances, tariffs=tariffs, surge=surge)
+    return [(d, v, s)
+            for i, d in enumerate(distances)
+            for j, v in enumerate(VEHICLES)
+            for k, s in enumerate(SHARING)
+            if fares[i, j, k] != calculate_price(d, v, s, tariffs, surge)]
+
+
+@pytest.mark.parametrize('surge', SURGES)
+def test_quote_matches_scalar(surge):
+    assert mismatches(samples(2_000), surge=surge) == []
+
+
+def test_custom_tariff():
+    tariffs = {'bike': {'fixed': 10, 'rate': 5}, 'auto': {'fixed': 30, 'rate': 11}, 'car': {'fixed': 40, 'rate': 11}}
+    assert mismatches(samples(2_000, seed=1), tariffs=tariffs) == []
+
+
+def test_table_lookup():
+    names = ['A', 'B', 'C']
+    table = FareTable.build(names, lambda a, b: 2.5 * abs(names.index(a) - names.index(b)))
+    assert price(table.lookup('A', 'C', 5.0), 'car', True) == calculate_price(5.0, 'car', True)
+    assert table.lookup('A', 'C', 5.1) is None
+    assert table.lookup('A', 'Z', 5.0) is None
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('surge', SURGES)
+def test_quote_matches_scalar_long(surge):
+    assert mismatches(samples(100_000), surge=surge) == []
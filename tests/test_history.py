@@ -0,0 +1,58 @@
+"""History times agree with SQLite's ``'localtime'`` on both sides of a DST change."""
+import time
+
+import pytest
+
+from ridesync_core import db, export, history
+from ridesync_core.history import RideHistoryManager
+
+# Both sides of 2024's New York DST changes, and the last minutes of a winter and a summer month
+TIMESTAMPS = [1710053940, 1710054060, 1730613540, 1730617260, 1706761800, 1722484740]
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    """Run with the process (libc, so SQLite too) in America/New_York, whatever the current offset is."""
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    monkeypatch.setattr(history, 'LOCAL_TZ', history.local_zone())
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def sqlite_local(db_name, timestamp):
+    with db.connection(db_name) as conn:
+        return conn.execute("SELECT strftime('%Y-%m-%d %H:%M:%S', ?, 'unixepoch', 'localtime')", (timestamp,)).fetchone()[0]
+
+
+def record(db_name, username):
+    with db.transaction(db_name) as s:
+        for t in TIMESTAMPS:
+            history.record_ride(s, username, {'from': 'A', 'to': 'B', 'vehicle': 'auto', 'price': 50, 'timestamp': t})
+
+
+@pytest.mark.parametrize('zone', ['tz', 'per_timestamp'])
+def test_display_matches_sqlite(make_db, new_york, monkeypatch, zone):
+    if zone == 'per_timestamp':
+        monkeypatch.setattr(history, 'LOCAL_TZ', None)
+    path = make_db()
+    record(path, 'tz_user')
+    shown = RideHistoryManager(path).get_user_dataframe('tz_user')['Date & Time']
+    assert sorted(shown) == sorted(sqlite_local(path, t) for t in TIMESTAMPS)
+
+
+def test_months_match_user_monthly(make_db, new_york):
+    path = make_db()
+    record(path, 'tz_user')
+    shown = RideHistoryManager(path).get_user_dataframe('tz_user')['Date & Time'].str[:7]
+    buckets = {r['month']: r['rides'] for r in db.fetchall('user_monthly', ('tz_user',), path)}
+    assert shown.value_counts().to_dict() == buckets
+
+
+def test_export_times(make_db, new_york):
+    path = make_db()
+    record(path, 'tz_user')
+    frames = list(export.iter_all_rides(db_name=path))
+    shown = [t for df in frames for t in df['Date & Time']]
+    assert shown == [sqlite_local(path, t) for t in sorted(TIMESTAMPS)]
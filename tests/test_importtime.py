@@ -0,0 +1,55 @@
+"""Import-time guard for the core package.
+
+Workers and batch jobs import ``ridesync_core`` without Streamlit, so no
+module there may pull in the UI stack, and the libraries only some paths need
+(pandas for history frames and exports, folium for maps, requests for OSRM
+fetches, pyarrow for Parquet) are imported inside the functions that use
+them. Each module is imported in a fresh interpreter and must load none of
+``HEAVY``; under the ``slow`` marker the import must also stay within
+``BUDGET_MS`` (best of three runs; interpreter start-up not included).
+"""
+import json
+import os
+import pkgutil
+import subprocess
+import sys
+
+import pytest
+
+import ridesync_core
+
+HEAVY = ('streamlit', 'streamlit_folium', 'pandas', 'folium', 'branca', 'requests', 'pyarrow')
+BUDGET_MS = 500
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1000, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+MODULES = [f'ridesync_core.{m.name}' for m in pkgutil.iter_modules(ridesync_core.__path__)]
+
+
+def probe(module, runs=1):
+    """``(best import ms, heavy modules loaded)`` for ``module``, each run in a fresh interpreter."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(ridesync_core.__file__)))
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, (root, os.environ.get('PYTHONPATH'))))}
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY)],
+                             env=env, capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return min(r['ms'] for r in results), results[0]['heavy']
+
+
+@pytest.mark.parametrize('module', MODULES)
+def test_no_heavy_imports(module):
+    _, heavy = probe(module)
+    assert heavy == []
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('module', MODULES)
+def test_import_budget(module):
+    ms, _ = probe(module, runs=3)
+    assert ms <= BUDGET_MS
@@ -0,0 +1,24 @@
+"""Short runs of the load generator (``tests/loadgen.py``); all under the ``slow`` marker."""
+import pytest
+
+from . import loadgen
+
+pytestmark = pytest.mark.slow
+
+
+def test_mixed_load(make_db):
+    report = loadgen.run(passengers=20, drivers=8, seconds=3, seed=1, db_name=make_db())
+    ops = report['operations']
+    assert {'book', 'poll_booking', 'pending', 'accept'} <= set(ops)
+    assert report['lock_waits']['timeouts'] == 0
+    # Every booking and join that went through left exactly one 'created' event
+    assert report['events']['created'] == sum(ops[op]['count'] - ops[op]['refused'] for op in ('book', 'join') if op in ops)
+
+
+def test_expiry_in_every_process(make_db, monkeypatch):
+    # Worker processes are fresh interpreters and read the TTL from the environment
+    monkeypatch.setenv('RIDESYNC_REQUEST_TTL', '0.5')
+    report = loadgen.run(passengers=10, drivers=0, seconds=4, processes=2, rates={'cancel': 0, 'join': 0}, db_name=make_db())
+    events = report['events']
+    # Each passenger's last request may still be pending; every earlier one expired on time
+    assert events['expired'] >= events['created'] - 10 > 0
@@ -0,0 +1,93 @@
+"""Schema migrations: fresh and existing databases reach ``SCHEMA_VERSION``, hot queries use indexes."""
+from ridesync_core import db, migrations, shards
+from ridesync_core.queries import SQL
+
+# Statements run on every poll or page load; none of them may scan a table.
+HOT_QUERIES = [
+    'user_password',
+    'trim_rides',
+    'user_rides',
+    'user_rides_page',
+    'user_stats',
+    'user_ride_count',
+    'pending_requests',
+    'driver_active_rides',
+    'passenger_active_request',
+    'matching_rides',
+    'pending_expiries',
+    'expire_request',
+    'mark_expired',
+    'request_channels',
+    'change_version',
+    'terminal_request_ids',
+    'route_cache_get',
+    'pending_requests_near',
+    'matching_rides_near',
+    'open_shared_rides',
+    'book_request',
+    'accept_request',
+    'complete_request',
+    'cancel_request',
+    'claim_seat',
+    'dispatch_requests',
+    'online_drivers',
+    'busy_drivers',
+    'stale_offers',
+    'driver_offers',
+    'request_events_since',
+    'request_events_floor',
+    'request_events_after',
+    'request_event_ids_after',
+    'max_request_id',
+    'request_events_from',
+    'user_monthly',
+    'rides_between_page',
+]
+
+
+def explain(name, db_name):
+    """The EXPLAIN QUERY PLAN detail lines for a named statement."""
+    sql = SQL[name]
+    params = (None,) * sql.count('?')
+    with db.connection(db_name) as conn:
+        return [row['detail'] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def full_scans(db_name, names=HOT_QUERIES):
+    """Map each hot statement that scans a table without an index to its plan."""
+    offenders = {}
+    for name in names:
+        plan = explain(name, db_name)
+        if any(line.startswith('SCAN ') and 'INDEX' not in line and line != 'SCAN CONSTANT ROW' for line in plan):
+            offenders[name] = plan
+    return offenders
+
+
+def version(db_name):
+    with db.connection(db_name) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def test_fresh_database(make_db):
+    path = make_db()
+    assert version(path) == migrations.SCHEMA_VERSION
+    assert full_scans(path) == {}
+
+
+def test_tracked_database(make_db, tracked_db):
+    path = make_db(source=tracked_db)
+    assert version(path) == migrations.SCHEMA_VERSION
+    assert full_scans(path) == {}
+
+
+def test_migrate_is_idempotent(make_db):
+    path = make_db()
+    migrations.migrate(path)
+    assert version(path) == migrations.SCHEMA_VERSION
+
+
+def test_shards_are_migrated(make_db):
+    path = make_db(count=3)
+    for shard in shards.layout(path).names:
+        assert version(shard) == migrations.SCHEMA_VERSION
+        assert full_scans(shard, ['pending_requests', 'book_request', 'expire_request']) == {}
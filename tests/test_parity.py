@@ -0,0 +1,122 @@
+"""Differential check of the in-memory request backend against SQLite.
+
+Replays one seeded stream of bookings, joins, accepts, completions and
+cancels against a plain ``RequestManager`` and the in-memory store
+(``RIDESYNC_REQUEST_BACKEND=memory``), each on its own throwaway copy of the
+same database. Every call must return the same result, the read methods
+(pending lists, nearby lists, a driver's rides, a passenger's request,
+shared-ride matching) must agree every ``CHECK_EVERY`` steps, and once the
+store has flushed, both files must hold the same requests, ride history,
+user totals and request event log.
+"""
+import random
+
+import pytest
+
+from ridesync_core import db
+from ridesync_core.fares import VEHICLES
+from ridesync_core.request_manager import RequestManager, open_manager
+
+CHECK_EVERY = 50
+PASSENGERS = [f'parity_p{i}' for i in range(12)]
+DRIVERS = [f'parity_d{i}' for i in range(4)]
+# Persisted state compared after the run; expiry_time depends on when each call ran
+PERSISTED = {
+    'requests': """SELECT id, passenger, pickup, destination, vehicle, price, status, driver, ride_type,
+                          current_passengers, max_passengers FROM all_requests ORDER BY id""",
+    'rides': "SELECT username, source, destination, vehicle, ride_type, price, status FROM rides ORDER BY id",
+    'user_stats': "SELECT * FROM user_stats ORDER BY username",
+    'events': "SELECT request_id, kind FROM request_events ORDER BY seq",
+}
+
+
+def _plain(value):
+    """Rows -> dicts without ``expiry_time``, recursively, so both backends compare equal."""
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if value is not None and hasattr(value, 'keys'):
+        return {k: _plain(value[k]) for k in value.keys() if k != 'expiry_time'}
+    return value
+
+
+def reads(manager, stops):
+    """Everything the app reads from a request manager, in a comparable form."""
+    near, destination = stops[0], stops[-1]
+    out = []
+    for vehicle in VEHICLES:
+        out.append(manager.get_pending_requests(vehicle))
+        out.append(manager.get_pending_requests(vehicle, near=near))
+    out += [manager.get_driver_active_rides(d) for d in DRIVERS]
+    out += [manager.get_passenger_active_request(p) for p in PASSENGERS]
+    out.append(sorted(manager.find_matching_rides(destination), key=lambda r: r['id']))
+    out.append(sorted(manager.find_matching_rides(destination, radius_km=3), key=lambda r: r['id']))
+    out.append(manager.find_matching_rides(destination, pickup=near))
+    return _plain(out)
+
+
+def step(rng, reference, managers, stops):
+    """One random operation, picked from the reference's state and applied to every manager; returns their results."""
+    op = rng.random()
+    if op < 0.3:
+        pickup, destination = rng.sample(stops, 2)
+        shared = rng.random() < 0.5
+        args = (rng.choice(PASSENGERS), pickup, destination, rng.choice(VEHICLES), 100, 'Shared' if shared else 'Solo', 3)
+        return [m.book_request(*args) for m in managers]
+    if op < 0.45:
+        pickup, destination = rng.sample(stops, 2)
+        rides = reference.find_matching_rides(destination)
+        if not rides:
+            return None
+        args = (rng.choice(rides)['id'], rng.choice(PASSENGERS), pickup, destination, 'auto', 80)
+        return [m.join_request(*args) for m in managers]
+    if op < 0.65:
+        pending = [r['id'] for vehicle in VEHICLES for r in reference.get_pending_requests(vehicle)]
+        if not pending:
+            return None
+        args = (rng.choice(pending), rng.choice(DRIVERS))
+        return [m.accept_request(*args) for m in managers]
+    if op < 0.8:
+        rides = [r['id'] for d in DRIVERS for r in reference.get_driver_active_rides(d)]
+        if not rides:
+            return None
+        req_id = rng.choice(rides)
+        return [m.complete_ride(req_id) is not None for m in managers]
+    mine = [r['id'] for r in map(reference.get_passenger_active_request, PASSENGERS) if r]
+    if not mine:
+        return None
+    req_id = rng.choice(mine)
+    return [m.cancel_request(req_id) for m in managers]
+
+
+def replay(sqlite_db, memory_db, steps=3000, seed=7):
+    """Replay ``steps`` operations on both backends; returns a list of mismatch descriptions (empty if they agree)."""
+    reference = RequestManager(sqlite_db)
+    memory = open_manager(memory_db, backend='memory')
+    stops = list(reference.stops.stops)
+    rng = random.Random(seed)
+    mismatches = []
+    for i in range(steps):
+        results = step(rng, reference, (reference, memory), stops)
+        if results is not None and _plain(results[0]) != _plain(results[1]):
+            mismatches.append(f"step {i}: results differ: {results}")
+        if i % CHECK_EVERY == 0 and reads(reference, stops) != reads(memory, stops):
+            mismatches.append(f"step {i}: reads differ")
+            break
+    memory.close()
+    for name, sql in PERSISTED.items():
+        with db.connection(sqlite_db) as a, db.connection(memory_db) as b:
+            if [tuple(r) for r in a.execute(sql)] != [tuple(r) for r in b.execute(sql)]:
+                mismatches.append(f"persisted {name} differ")
+    return mismatches
+
+
+
+def test_parity(make_db):
+    assert replay(make_db('sqlite.db'), make_db('memory.db'), steps=1000) == []
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('steps, from_tracked', [(3000, False), (1500, True)])
+def test_parity_long(make_db, tracked_db, steps, from_tracked):
+    source = tracked_db if from_tracked else None
+    assert replay(make_db('sqlite.db', source=source), make_db('memory.db', source=source), steps) == []
@@ -0,0 +1,85 @@
+"""Offline routing: landmark A* (ALT) must find the same distances as plain Dijkstra."""
+import random
+import time
+
+import pytest
+
+from ridesync_core.roadgraph import HEADER_V1, MAGIC_V1, RoadGraph, haversine_m
+
+LAT0, LON0, STEP = 23.0, 72.5, 0.0005
+
+
+def grid(n, seed=0, oneway=0.0, islands=0):
+    """``n`` x ``n`` jittered street grid, edges 1-1.6x the straight line; ``oneway`` of the streets run
+    one way only and ``islands`` extra nodes connect to nothing."""
+    rng = random.Random(seed)
+    coords = [(LAT0 + i * STEP + rng.uniform(-1e-4, 1e-4), LON0 + j * STEP + rng.uniform(-1e-4, 1e-4))
+              for i in range(n) for j in range(n)]
+    edges = []
+    for u in range(n * n):
+        for v in (u + 1 if (u + 1) % n else None, u + n if u + n < n * n else None):
+            if v is not None:
+                metres = haversine_m(*coords[u], *coords[v]) * rng.uniform(1.0, 1.6)
+                edges += [(u, v, metres)] if rng.random() < oneway else [(u, v, metres), (v, u, metres)]
+    coords += [(LAT0 - STEP * (k + 1), LON0) for k in range(islands)]
+    return RoadGraph.from_edges(coords, edges)
+
+
+def pairs(graph, count, seed=1):
+    rng = random.Random(seed)
+    return [(rng.randrange(len(graph)), rng.randrange(len(graph))) for _ in range(count)]
+
+
+def assert_exact(graph, sample):
+    for source, target in sample:
+        expected = graph._dijkstra(source)[target]
+        found = graph.shortest_path(source, target)
+        if expected == float('inf'):
+            assert found is None
+        else:
+            metres, path = found
+            assert metres == pytest.approx(expected)
+            assert path[0] == source and path[-1] == target
+
+
+def test_matches_dijkstra():
+    graph = grid(30, oneway=0.2, islands=2)
+    assert len(graph.landmarks) == 8
+    assert_exact(graph, pairs(graph, 300) + [(0, len(graph) - 1), (len(graph) - 1, 0)])
+
+
+def test_save_and_load(tmp_path):
+    graph = grid(12, oneway=0.2)
+    graph.save(tmp_path / 'city.graph')
+    loaded = RoadGraph.load(tmp_path / 'city.graph')
+    assert [node for node, _, _ in loaded.landmarks] == [node for node, _, _ in graph.landmarks]
+    assert loaded.route((LAT0, LON0), (LAT0 + 0.004, LON0 + 0.004)) == graph.route((LAT0, LON0), (LAT0 + 0.004, LON0 + 0.004))
+
+
+def test_loads_files_without_landmarks(tmp_path):
+    graph = grid(12, oneway=0.2)
+    with open(tmp_path / 'old.graph', 'wb') as f:
+        f.write(MAGIC_V1 + HEADER_V1.pack(len(graph), len(graph.targets)))
+        for arr in (graph.lat, graph.lon, graph.offsets, graph.targets, graph.weights):
+            arr.tofile(f)
+    loaded = RoadGraph.load(tmp_path / 'old.graph')
+    assert len(loaded.landmarks) == len(graph.landmarks)
+    assert_exact(loaded, pairs(loaded, 50))
+
+
+@pytest.mark.slow
+def test_landmarks_speed_up_cold_routes():
+    graph = grid(200)
+    plain = RoadGraph(graph.lat, graph.lon, graph.offsets, graph.targets, graph.weights, landmarks=[])
+    sample = pairs(graph, 100)
+
+    def per_route_ms(g):
+        start = time.perf_counter()
+        found = [g._astar(s, t)[0] for s, t in sample]
+        return (time.perf_counter() - start) * 1000 / len(sample), found
+
+    alt_ms, alt = per_route_ms(graph)
+    plain_ms, expected = per_route_ms(plain)
+    print(f"cold route: {plain_ms:.1f} ms haversine A*, {alt_ms:.1f} ms ALT")
+    assert alt == pytest.approx(expected)
+    assert alt_ms * 3 < plain_ms
@@ -0,0 +1,139 @@
+"""OSRM routing against a stub HTTP server: answers, fallbacks, the cache and warm-up."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import polyline
+import pytest
+
+from ridesync_core import routing
+
+SATELLITE, VASTRAPUR, BODAKDEV = (23.03, 72.517), (23.0365, 72.5294), (23.0422, 72.5112)
+STOPS = [SATELLITE, VASTRAPUR, BODAKDEV, (22.9912, 72.4884), (23.0063, 72.5077)]
+
+
+class StubOSRM(ThreadingHTTPServer):
+    """Answers ``/route/v1/driving/...`` like OSRM, in one of the ``MODES``; counts requests and peak concurrency."""
+    daemon_threads = True
+    MODES = ('ok', 'no_route', 'error', 'slow')
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.mode, self.delay = 'ok', 0.0
+        self.requests = self.active = self.peak = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+        try:
+            time.sleep(server.delay if server.mode != 'slow' else 2)
+            if server.mode == 'error':
+                self.send_response(502)
+                self.end_headers()
+                self.wfile.write(b'<html>Bad Gateway</html>')
+                return
+            coords = self.path.split('/')[-1].split('?')[0]
+            (src_lon, src_lat), (dst_lon, dst_lat) = (map(float, p.split(',')) for p in coords.split(';'))
+            path = [(src_lat, src_lon), ((src_lat + dst_lat) / 2, src_lon), (dst_lat, dst_lon)]
+            body = ({'code': 'NoRoute', 'routes': []} if server.mode == 'no_route' else
+                    {'code': 'Ok', 'routes': [{'distance': 4321.0, 'geometry': polyline.encode(path)}]})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(body).encode())
+        except (BrokenPipeError, ConnectionResetError):
+            pass   # the client gave up (timeout)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def osrm():
+    server = StubOSRM()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_route_from_server(make_db, osrm):
+    db_name = make_db()
+    distance, path = routing.get_route(SATELLITE, VASTRAPUR, base_url=osrm.url, db_name=db_name, backends=['osrm'])
+    assert distance == 4.32
+    assert tuple(path[0]) == SATELLITE and tuple(path[-1]) == VASTRAPUR and len(path) == 3
+    assert routing.cached_route(SATELLITE, VASTRAPUR, db_name)[0] == 4.32
+
+
+def test_cache_hit_skips_the_server(make_db, osrm):
+    db_name = make_db()
+    first = routing.get_route(SATELLITE, VASTRAPUR, base_url=osrm.url, db_name=db_name, backends=['osrm'])
+    osrm.mode = 'error'
+    assert routing.get_route(SATELLITE, VASTRAPUR, base_url=osrm.url, db_name=db_name, backends=['osrm']) == first
+    assert osrm.requests == 1
+
+
+def test_stale_entries_are_fetched_again(make_db, osrm, monkeypatch):
+    db_name = make_db()
+    routing.get_route(SATELLITE, VASTRAPUR, base_url=osrm.url, db_name=db_name, backends=['osrm'])
+    monkeypatch.setattr(routing, 'ROUTE_CACHE_VERSION', routing.ROUTE_CACHE_VERSION + 1)
+    routing.get_route(SATELLITE, VASTRAPUR, base_url=osrm.url, db_name=db_name, backends=['osrm'])
+    assert osrm.requests == 2
+
+
+@pytest.mark.parametrize('mode', ['no_route', 'error', 'slow'])
+def test_failures_fall_back_to_straight_line(make_db, osrm, monkeypatch, mode):
+    monkeypatch.setattr(routing, 'ROUTE_TIMEOUT', (0.5, 0.5))
+    db_name = make_db()
+    osrm.mode = mode
+    start = time.perf_counter()
+    route = routing.get_route(SATELLITE, VASTRAPUR, base_url=osrm.url, db_name=db_name, backends=['osrm'])
+    assert time.perf_counter() - start < 1.5
+    assert route == routing.straight_line_route(SATELLITE, VASTRAPUR)
+    # A failure is never cached: the next call asks again
+    assert routing.cached_route(SATELLITE, VASTRAPUR, db_name) is None
+
+
+def test_unreachable_server_falls_back(make_db, osrm):
+    url = osrm.url
+    osrm.shutdown()
+    osrm.server_close()
+    route = routing.get_route(SATELLITE, VASTRAPUR, base_url=url, db_name=make_db(), backends=['osrm'])
+    assert route == routing.straight_line_route(SATELLITE, VASTRAPUR)
+
+
+def test_concurrent_warm_up(make_db, osrm):
+    db_name = make_db()
+    osrm.delay = 0.05
+    pairs = len(STOPS) * (len(STOPS) - 1)
+    assert routing.warm_cache(STOPS, base_url=osrm.url, db_name=db_name, workers=8) == pairs
+    assert osrm.requests == pairs and osrm.peak > 1
+    assert all(routing.cached_route(a, b, db_name) for a in STOPS for b in STOPS if a != b)
+    # Everything is cached now: nothing left to fetch, and routes come from the cache
+    assert routing.warm_cache(STOPS, base_url=osrm.url, db_name=db_name) == 0
+    routing.get_route(BODAKDEV, SATELLITE, base_url=osrm.url, db_name=db_name, backends=['osrm'])
+    assert osrm.requests == pairs
+
+
+def test_warm_up_runs_once_per_database(make_db, osrm, monkeypatch):
+    monkeypatch.setattr(routing, 'ROUTING_BACKENDS', ['osrm'])
+    db_name = make_db()
+    thread = routing.warm_cache_async(STOPS[:3], base_url=osrm.url, db_name=db_name)
+    assert routing.warm_cache_async(STOPS[:3], base_url=osrm.url, db_name=db_name) is None
+    thread.join(5)
+    assert osrm.requests == 6